@@ -1,38 +1,66 @@
 import logging
-import time
 from datetime import timedelta
+from typing import List
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers import device_registry as dr
 from homeassistant.helpers.device_registry import DeviceEntry
 from homeassistant.helpers.event import async_track_time_interval
 
 from .const import DOMAIN, SUPPORTED_PLATFORMS, FILTER_TYPE_EXCLUDE, FILTER_TYPE_INCLUDE
-from .core.client import HaierClient, HaierClientException, TokenInfo
-from .core.config import AccountConfig, DeviceFilterConfig, EntityFilterConfig
+from .core.client import HaierClient, DEVICE_INFOS_CACHE_TTL
+from .core.config import AccountConfig, DeviceFilterConfig, EntityFilterConfig, AdvancedConfig
+from .core.device import HaierDevice
 from .core.device_gateway import HaierDeviceGateway
+from .core.token_manager import HaierTokenManager
 
 _LOGGER = logging.getLogger(__name__)
 
+# 检查设备列表变化（新增/删除设备）的间隔
+DEVICE_DISCOVERY_INTERVAL = timedelta(minutes=10)
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     hass.data.setdefault(DOMAIN, {
         'devices': [],
-        'cancel_token_updater': None,
+        'client': None,
+        'gateway': None,
+        'entry_data': None,
+        'token_manager': None,
         'gateway_task': None,
+        'advanced': None,
+        # 平台 -> (async_add_entities, 实体创建函数)
+        'platforms': {},
+        # 已创建实体的设备（未被设备筛选排除）
+        'registered_devices': set(),
     })
 
-    # 定时更新token
-    hass.data[DOMAIN]['cancel_token_updater'] = await token_updater(hass, entry)
-
     account_cfg = AccountConfig(hass, entry)
     client = HaierClient(hass, account_cfg.client_id, account_cfg.token)
+    hass.data[DOMAIN]['client'] = client
+
+    # 在token过期前定时刷新，接口返回token失效时也会立即刷新
+    token_manager = HaierTokenManager(hass, entry, client, lambda token: apply_token(hass, token))
+    token_manager.start()
+    hass.data[DOMAIN]['token_manager'] = token_manager
 
     devices = await client.get_devices()
     _LOGGER.info('共获取到{}个设备'.format(len(devices)))
     hass.data[DOMAIN]['devices'] = devices
 
-    # 启动网关
-    gateway = HaierDeviceGateway(hass, client, account_cfg.token)
+    # 启动网关（获取设备期间token可能已被刷新，需重新读取）
+    advanced_cfg = AdvancedConfig(hass, entry)
+    hass.data[DOMAIN]['advanced'] = advanced_cfg
+    gateway = HaierDeviceGateway(
+        hass,
+        client,
+        AccountConfig(hass, entry).token,
+        init_mode=advanced_cfg.init_mode,
+        wait_command_ack=advanced_cfg.wait_command_ack,
+        refresh_intervals=advanced_cfg.refresh_intervals,
+        connection_shards=advanced_cfg.connection_shards
+    )
+    hass.data[DOMAIN]['gateway'] = gateway
     hass.data[DOMAIN]['gateway_task'] = hass.async_create_background_task(
         gateway.connect(devices),
         'haier-gateway'
@@ -40,69 +68,25 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
 
     await hass.config_entries.async_forward_entry_setups(entry, SUPPORTED_PLATFORMS)
 
+    hass.data[DOMAIN]['entry_data'] = get_reload_sensitive_data(entry)
     entry.async_on_unload(entry.add_update_listener(entry_update_listener))
 
-    return True
+    # 定期检查账号下的设备变化，新增或删除设备无需重载集成
+    async def discover_devices(now):
+        await async_discover_devices(hass, entry)
 
-async def token_updater(hass: HomeAssistant, entry: ConfigEntry):
-    """
-    token更新器
-    :param hass:
-    :param entry:
-    :return:
-    """
-    async def try_update_token():
-        """
-        尝试刷新token，刷新成功返回True，如refresh_token无效则会抛出异常
-        :return:
-        """
-        _LOGGER.debug("try update token...")
-
-        cfg = AccountConfig(hass, entry)
-        client = HaierClient(hass, cfg.client_id, cfg.token)
-
-        token_valid = True
-        try:
-            await client.get_user_info()
-        except HaierClientException:
-            token_valid = False
-
-        # token有效且里过期时间大于1天时不更新token
-        if token_valid and cfg.expires_at - int(time.time()) > 86400:
-            return False
-
-        token_info = await client.refresh_token(cfg.refresh_token)
-        cfg.token = token_info.token
-        cfg.refresh_token = token_info.refresh_token
-        cfg.expires_at = int(time.time()) + token_info.expires_in
-        cfg.save()
-
-        return True
-
-    async def task(now):
-        try:
-            if await try_update_token():
-                _LOGGER.info('token refreshed, reload integration...')
-                await hass.config_entries.async_reload(entry.entry_id)
-            else:
-                _LOGGER.debug('token is valid')
-        except Exception:
-            _LOGGER.exception('token update failed')
-
-    # 手动执行一次更新
-    await try_update_token()
-
-    # 每1小时检查一次token有效性，若token刷新则重载集成
-    return async_track_time_interval(hass, task, timedelta(hours=1))
+    entry.async_on_unload(async_track_time_interval(hass, discover_devices, DEVICE_DISCOVERY_INTERVAL))
+
+    return True
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     if not await hass.config_entries.async_unload_platforms(entry, SUPPORTED_PLATFORMS):
         return False
 
     # 停止token更新
-    if hass.data[DOMAIN]['cancel_token_updater']:
-        hass.data[DOMAIN]['cancel_token_updater']()
-        _LOGGER.info('token updater stopped')
+    if hass.data[DOMAIN]['token_manager']:
+        hass.data[DOMAIN]['token_manager'].stop()
+        _LOGGER.info('token manager stopped')
 
     # 断开网关
     if hass.data[DOMAIN]['gateway_task']:
@@ -114,7 +98,50 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     return True
 
 
+async def apply_token(hass: HomeAssistant, token: str):
+    """
+    将新token应用到运行中的client和网关，无需重载集成
+    :param hass:
+    :param token:
+    :return:
+    """
+    hass.data[DOMAIN]['client'].update_token(token)
+
+    if hass.data[DOMAIN]['gateway']:
+        await hass.data[DOMAIN]['gateway'].update_token(token)
+
+
+def get_reload_sensitive_data(entry: ConfigEntry) -> dict:
+    """
+    配置中除token相关字段外的数据，只有这部分数据变化时才需要重载集成
+    :param entry:
+    :return:
+    """
+    account = {
+        key: value for key, value in entry.data.get('account', {}).items()
+        if key not in ('token', 'refresh_token', 'expires_at')
+    }
+
+    return {**entry.data, 'account': account}
+
+
+def without_device_filter(data: dict) -> dict:
+    return {key: value for key, value in data.items() if key != 'device_filter'}
+
+
 async def entry_update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    # token刷新同样会触发此回调，此时token已原地更新，无需重载
+    data = get_reload_sensitive_data(entry)
+    if data == hass.data[DOMAIN]['entry_data']:
+        _LOGGER.debug('only token changed, skip reload')
+        return
+
+    # 仅设备筛选发生变化时直接增删对应设备的实体
+    if without_device_filter(data) == without_device_filter(hass.data[DOMAIN]['entry_data']):
+        hass.data[DOMAIN]['entry_data'] = data
+        apply_device_filter(hass, entry)
+        return
+
     _LOGGER.info('reload haier integration...')
     await hass.config_entries.async_reload(entry.entry_id)
 
@@ -144,18 +171,119 @@ async def async_remove_config_entry_device(hass: HomeAssistant, config: ConfigEn
     return True
 
 async def async_register_entity(hass: HomeAssistant, entry: ConfigEntry, async_add_entities, platform, setup) -> None:
-    entities = []
-    for device in hass.data[DOMAIN]['devices']:
-        if DeviceFilterConfig.is_skip(hass, entry, device.id):
-            continue
+    # 保存下来用于之后新增设备时创建实体
+    hass.data[DOMAIN]['platforms'][platform] = (async_add_entities, setup)
+
+    add_device_entities(hass, entry, hass.data[DOMAIN]['devices'], [platform])
 
-        for attribute in device.attributes:
-            if attribute.platform != platform:
-                continue
 
-            if EntityFilterConfig.is_skip(hass, entry, device.id, attribute.key):
+def add_device_entities(hass: HomeAssistant, entry: ConfigEntry, devices: List[HaierDevice], platforms=None) -> None:
+    """
+    为设备创建实体
+    :param hass:
+    :param entry:
+    :param devices:
+    :param platforms: 为None时在所有已加载的平台上创建
+    :return:
+    """
+    if platforms is None:
+        platforms = list(hass.data[DOMAIN]['platforms'].keys())
+
+    for platform in platforms:
+        async_add_entities, setup = hass.data[DOMAIN]['platforms'][platform]
+
+        entities = []
+        for device in devices:
+            if DeviceFilterConfig.is_skip(hass, entry, device.id):
                 continue
 
-            entities.append(setup(device, attribute))
+            hass.data[DOMAIN]['registered_devices'].add(device.id)
+            for attribute in device.attributes:
+                if attribute.platform != platform:
+                    continue
+
+                if EntityFilterConfig.is_skip(hass, entry, device.id, attribute.key):
+                    continue
+
+                entities.append(setup(device, attribute))
+
+        if entities:
+            async_add_entities(entities)
+
+
+def remove_device_entities(hass: HomeAssistant, device_ids: List[str]) -> None:
+    """
+    从设备注册表中移除设备，设备下的实体会一并移除
+    :param hass:
+    :param device_ids:
+    :return:
+    """
+    registry = dr.async_get(hass)
+    for device_id in device_ids:
+        hass.data[DOMAIN]['registered_devices'].discard(device_id)
+        device_entry = registry.async_get_device(identifiers={(DOMAIN, device_id.lower())})
+        if device_entry is not None:
+            registry.async_remove_device(device_entry.id)
+
+
+def apply_device_filter(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """
+    设备筛选变化后增删对应设备的实体
+    :param hass:
+    :param entry:
+    :return:
+    """
+    registered = hass.data[DOMAIN]['registered_devices']
+    devices = hass.data[DOMAIN]['devices']
+
+    removed = [
+        device.id for device in devices
+        if device.id in registered and DeviceFilterConfig.is_skip(hass, entry, device.id)
+    ]
+    added = [
+        device for device in devices
+        if device.id not in registered and not DeviceFilterConfig.is_skip(hass, entry, device.id)
+    ]
 
-    async_add_entities(entities)
+    if removed:
+        _LOGGER.info('Devices excluded by filter: {}'.format(removed))
+        remove_device_entities(hass, removed)
+
+    if added:
+        _LOGGER.info('Devices included by filter: {}'.format([device.id for device in added]))
+        add_device_entities(hass, entry, added)
+
+
+async def async_discover_devices(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """
+    对比账号下的设备列表与已加载的设备，增删发生变化的设备，其他设备不受影响
+    :param hass:
+    :param entry:
+    :return:
+    """
+    client = hass.data[DOMAIN]['client']
+    gateway = hass.data[DOMAIN]['gateway']
+    devices = hass.data[DOMAIN]['devices']
+
+    try:
+        online_statues = await client.get_devices_online_status()
+        known = {device.id for device in devices}
+        added = await client.get_devices(exclude=known, max_age=DEVICE_INFOS_CACHE_TTL)
+    except Exception:
+        _LOGGER.exception('Failed to discover devices')
+        return
+
+    # 接口偶尔会返回空列表，此时不删除任何设备
+    removed = [device_id for device_id in known if online_statues and device_id not in online_statues]
+
+    if removed:
+        _LOGGER.info('Devices removed from account: {}'.format(removed))
+        gateway.remove_devices(removed)
+        remove_device_entities(hass, removed)
+        devices[:] = [device for device in devices if device.id not in removed]
+
+    if added:
+        _LOGGER.info('New devices found: {}'.format([device.id for device in added]))
+        devices.extend(added)
+        await gateway.async_add_devices(added)
+        add_device_entities(hass, entry, added)
@@ -1,4 +1,5 @@
 import logging
+from typing import List
 
 from homeassistant.components.climate import ClimateEntity, ClimateEntityFeature, HVACMode, FAN_HIGH, \
     FAN_MEDIUM, FAN_LOW, SWING_OFF, SWING_VERTICAL, SWING_HORIZONTAL, SWING_BOTH, FAN_OFF, FAN_AUTO
@@ -59,6 +60,21 @@ class HaierClimate(HaierAbstractEntity, ClimateEntity):
                                         | ClimateEntityFeature.TURN_OFF \
                                         | ClimateEntityFeature.TURN_ON
 
+    def _get_data_keys(self) -> List[str]:
+        return [
+            'indoorTemperature',
+            'indoorHumidity',
+            'targetTemperature',
+            'onOffStatus',
+            'operationMode',
+            'windSpeed',
+            'windSpeedL',
+            'windDirectionVertical',
+            'windDirectionVerticalL',
+            'windDirectionHorizontal',
+            'windDirectionHorizontalL'
+        ]
+
     def _update_value(self):
         if 'indoorTemperature' in self._attributes_data:
             self._attr_current_temperature = float(self._attributes_data['indoorTemperature'])
@@ -104,27 +120,27 @@ class HaierClimate(HaierAbstractEntity, ClimateEntity):
                     if wind_direction_vertical != 0:
                         self._attr_swing_mode = SWING_VERTICAL
 
-    def turn_on(self) -> None:
-        self.set_hvac_mode(HVACMode.AUTO)
+    async def async_turn_on(self) -> None:
+        await self.async_set_hvac_mode(HVACMode.AUTO)
 
-    def turn_off(self) -> None:
-        self.set_hvac_mode(HVACMode.OFF)
+    async def async_turn_off(self) -> None:
+        await self.async_set_hvac_mode(HVACMode.OFF)
 
-    def set_hvac_mode(self, hvac_mode: HVACMode) -> None:
+    async def async_set_hvac_mode(self, hvac_mode: HVACMode) -> None:
         # 关机
         if hvac_mode == HVACMode.OFF:
-            self._send_command({
+            await self._async_send_command({
                 'onOffStatus': False
             })
             return
 
         # 关机状态则先开机
         if not try_read_as_bool(self._attributes_data['onOffStatus']):
-            self._send_command({
+            await self._async_send_command({
                 'onOffStatus': True
             })
 
-        self._send_command({
+        await self._async_send_command({
             'operationMode': {
                 HVACMode.AUTO: 0,
                 HVACMode.COOL: 1,
@@ -134,7 +150,7 @@ class HaierClimate(HaierAbstractEntity, ClimateEntity):
             }[hvac_mode]
         })
 
-    def set_fan_mode(self, fan_mode: str) -> None:
+    async def async_set_fan_mode(self, fan_mode: str) -> None:
         value = {
             FAN_HIGH: 1,
             FAN_MEDIUM: 2,
@@ -143,16 +159,16 @@ class HaierClimate(HaierAbstractEntity, ClimateEntity):
         }[fan_mode]
 
         if self._attribute.ext['exist_multiple_vents']:
-            self._send_command({
+            await self._async_send_command({
                 'windSpeedL': value,
                 'windSpeedR': value
             })
         else:
-            self._send_command({
+            await self._async_send_command({
                 'windSpeed': value
             })
 
-    def set_swing_mode(self, swing_mode: str) -> None:
+    async def async_set_swing_mode(self, swing_mode: str) -> None:
         v_h_values = [0, 0]
         if swing_mode == SWING_OFF:
             v_h_values = [0, 0]
@@ -167,20 +183,20 @@ class HaierClimate(HaierAbstractEntity, ClimateEntity):
             v_h_values = [8, 7]
 
         if self._attribute.ext['exist_multiple_vents']:
-            self._send_command({
+            await self._async_send_command({
                 'windDirectionVerticalL': v_h_values[0],
                 'windDirectionVerticalR': v_h_values[0],
                 'windDirectionHorizontalL': v_h_values[1],
                 'windDirectionHorizontalR': v_h_values[1]
             })
         else:
-            self._send_command({
+            await self._async_send_command({
                 'windDirectionVertical': v_h_values[0],
                 'windDirectionHorizontal': v_h_values[1]
             })
 
-    def set_temperature(self, **kwargs) -> None:
-        self._send_command({
+    async def async_set_temperature(self, **kwargs) -> None:
+        await self._async_send_command_debounced({
             'targetTemperature': kwargs['temperature']
         })
 
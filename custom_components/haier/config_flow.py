@@ -8,9 +8,10 @@ from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.helpers.config_validation import multi_select
 
-from .const import DOMAIN, FILTER_TYPE_EXCLUDE, FILTER_TYPE_INCLUDE
+from .const import DOMAIN, FILTER_TYPE_EXCLUDE, FILTER_TYPE_INCLUDE, INIT_MODE_REST, INIT_MODE_WEBSOCKET, \
+    DEFAULT_REFRESH_INTERVALS
 from .core.client import HaierClientException, HaierClient
-from .core.config import AccountConfig, DeviceFilterConfig, EntityFilterConfig
+from .core.config import AccountConfig, DeviceFilterConfig, EntityFilterConfig, AdvancedConfig
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -74,7 +75,7 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         """
         return self.async_show_menu(
             step_id="init",
-            menu_options=['account', 'device', 'entity_device_selector']
+            menu_options=['account', 'device', 'entity_device_selector', 'advanced']
         )
 
     async def async_step_account(self,  user_input: dict[str, Any] | None = None) -> FlowResult:
@@ -224,3 +225,56 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             )
         )
 
+    async def async_step_advanced(self, user_input: dict[str, Any] | None = None) -> FlowResult:
+        """
+        高级设置
+        :param user_input:
+        :return:
+        """
+        errors: Dict[str, str] = {}
+
+        cfg = AdvancedConfig(self.hass, self.config_entry)
+
+        if user_input is not None:
+            try:
+                # 清空输入框时表单中不会包含该字段，此时恢复为默认配置
+                refresh_intervals = user_input.get('refresh_intervals', '').strip()
+                cfg.refresh_intervals = AdvancedConfig.parse_refresh_intervals(refresh_intervals) \
+                    if refresh_intervals else dict(DEFAULT_REFRESH_INTERVALS)
+                cfg.init_mode = user_input['init_mode']
+                cfg.wait_command_ack = user_input['wait_command_ack']
+                cfg.optimistic_update = user_input['optimistic_update']
+                cfg.write_debounce = user_input['write_debounce']
+                cfg.connection_shards = user_input['connection_shards']
+                cfg.save()
+
+                return self.async_create_entry(title='', data={})
+            except ValueError:
+                errors['refresh_intervals'] = 'invalid_refresh_intervals'
+
+        return self.async_show_form(
+            step_id="advanced",
+            data_schema=vol.Schema(
+                {
+                    vol.Required('init_mode', default=cfg.init_mode): vol.In({
+                        INIT_MODE_REST: 'REST',
+                        INIT_MODE_WEBSOCKET: 'WebSocket',
+                    }),
+                    vol.Required('wait_command_ack', default=cfg.wait_command_ack): bool,
+                    vol.Required('optimistic_update', default=cfg.optimistic_update): bool,
+                    vol.Required('write_debounce', default=cfg.write_debounce): vol.All(
+                        vol.Coerce(float), vol.Range(min=0, max=5)
+                    ),
+                    vol.Optional(
+                        'refresh_intervals',
+                        description={
+                            'suggested_value': AdvancedConfig.format_refresh_intervals(cfg.refresh_intervals)
+                        }
+                    ): str,
+                    vol.Required('connection_shards', default=cfg.connection_shards): vol.All(
+                        vol.Coerce(int), vol.Range(min=1, max=10)
+                    )
+                }
+            ),
+            errors=errors
+        )
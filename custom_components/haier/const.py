@@ -15,3 +15,15 @@ SUPPORTED_PLATFORMS = [
 
 FILTER_TYPE_INCLUDE = 'include'
 FILTER_TYPE_EXCLUDE = 'exclude'
+
+# 连接网关后获取设备初始数据的方式
+INIT_MODE_REST = 'rest'
+INIT_MODE_WEBSOCKET = 'websocket'
+
+# 写入防抖窗口默认值（秒）
+DEFAULT_WRITE_DEBOUNCE = 0.5
+
+# 需要定时发送刷新命令才能保持数据更新的产品及刷新间隔（秒）
+DEFAULT_REFRESH_INTERVALS = {
+    'JSQ30-16R3BWU1': 60
+}
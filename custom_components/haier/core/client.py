@@ -5,7 +5,7 @@ import logging
 import random
 import time
 from functools import wraps
-from typing import List, Dict
+from typing import List, Dict, Tuple, Callable, Awaitable, Iterable
 from urllib.parse import urlparse
 
 import aiohttp
@@ -14,6 +14,7 @@ from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.storage import Store
 
 from .device import HaierDevice
+from .retry import RetryPolicy, CircuitBreaker, CIRCUIT_OPEN, parse_retry_after
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -26,38 +27,71 @@ GET_DEVICES_API = 'https://uws.haier.net/uds/v1/protected/deviceinfos'
 GET_WSS_GW_API = 'https://uws.haier.net/gmsWS/wsag/assign'
 GET_DIGITAL_MODEL_API = 'https://uws.haier.net/shadow/v1/devdigitalmodels'
 
-def retry_on_exception(exceptions, max_tries=3):
+# 批量获取digital model时单次请求包含的设备数
+DIGITAL_MODEL_CHUNK_SIZE = 20
+# 初始化设备时同时读写缓存的设备数
+DEVICE_INIT_CONCURRENCY = 8
+# 设备列表缓存时长（秒），用于合并短时间内重复的deviceinfos请求
+DEVICE_INFOS_CACHE_TTL = 10
+# 表示token无效或已过期的retCode，只有这些错误才会触发刷新token后重试
+AUTH_ERROR_RET_CODES = frozenset({'B00004'})
+
+def retry_on_exception(exceptions, endpoint: str = None, refresh_on_auth_error: bool = True):
     """
-    重试装饰器
+    重试装饰器，按客户端的重试策略进行指数退避，并在endpoint熔断时直接失败
     :param exceptions: 需要捕获并重试的异常（元组）
-    :param max_tries: 最大尝试次数
+    :param endpoint: 接口地址，用于区分熔断器
+    :param refresh_on_auth_error: token失效时是否刷新token后重试一次
     """
 
     def decorator(func):
         @wraps(func)
-        async def wrapper(*args, **kwargs):
-            last_exception = None
+        async def wrapper(self, *args, **kwargs):
+            policy = self.retry_policy
+            breaker = self.get_circuit_breaker(endpoint) if endpoint else None
             attempt = 0
+            auth_retried = False
+
+            # 一次调用（包括其中的重试）只占用一次熔断器的放行和计数
+            if breaker and not breaker.allow_request():
+                raise HaierCircuitOpenException(
+                    '接口 {} 已熔断，{:.0f}秒后重试'.format(endpoint, breaker.retry_in)
+                )
 
             while True:
                 try:
-                    return await func(*args, **kwargs)
+                    result = await func(self, *args, **kwargs)
+                except HaierAuthException:
+                    handler = self.auth_error_handler
+                    if not refresh_on_auth_error or auth_retried or handler is None:
+                        raise
+
+                    auth_retried = True
+                    if not await handler():
+                        raise
+
+                    _LOGGER.info('token refreshed, retrying request...')
+                    continue
                 except exceptions as err:
-                    if attempt < max_tries:
-                        _LOGGER.warning(
-                            "捕获到异常 %s。进行第 %s 次重试...",
-                            type(err).__name__, attempt + 1
-                        )
-
-                    else:
-                        last_exception = err
-                        break
-                finally:
                     attempt += 1
+                    if attempt > policy.max_retries:
+                        _LOGGER.error("达到最大重试次数 (%s): %s", policy.max_retries, err)
+                        if breaker:
+                            breaker.record_failure()
+                        raise
 
-            _LOGGER.error("达到最大重试次数 (%s): %s", max_tries, last_exception)
+                    delay = policy.compute_delay(attempt, getattr(err, 'retry_after', None))
+                    _LOGGER.warning(
+                        "捕获到异常 %s。%.2f秒后进行第 %s 次重试...",
+                        type(err).__name__, delay, attempt
+                    )
+                    await asyncio.sleep(delay)
+                    continue
 
-            raise last_exception
+                if breaker:
+                    breaker.record_success()
+
+                return result
 
         return wrapper
 
@@ -88,15 +122,89 @@ class HaierClientException(Exception):
     pass
 
 
+class HaierServerBusyException(HaierClientException):
+    """
+    服务端繁忙（429/5xx），可重试
+    """
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class HaierAuthException(HaierClientException):
+    """
+    token无效或已过期
+    """
+    pass
+
+
+class HaierCircuitOpenException(HaierClientException):
+    """
+    接口已熔断
+    """
+    pass
+
+
+RETRYABLE_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError, HaierServerBusyException)
+
+
 class HaierClient:
 
-    def __init__(self, hass: HomeAssistant, client_id: str, token: str):
+    def __init__(self, hass: HomeAssistant, client_id: str, token: str, retry_policy: RetryPolicy = None):
         self._client_id = client_id
         self._token = token
         self._hass = hass
         self._session = async_get_clientsession(hass)
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self._in_flight_requests: Dict[str, asyncio.Task] = {}
+        self._auth_error_handler: Callable[[], Awaitable[bool]] | None = None
+        self._device_infos_cache: Tuple[float, List[dict]] | None = None
+
+    def update_token(self, token: str):
+        """
+        原地更新token，之后发出的请求都会使用新token签名
+        :param token:
+        :return:
+        """
+        self._token = token
+
+    @property
+    def auth_error_handler(self) -> Callable[[], Awaitable[bool]] | None:
+        return self._auth_error_handler
+
+    def set_auth_error_handler(self, handler: Callable[[], Awaitable[bool]] | None):
+        """
+        设置token失效时的处理函数，返回True表示token已刷新，请求会使用新token重试一次
+        :param handler:
+        :return:
+        """
+        self._auth_error_handler = handler
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self._retry_policy
+
+    @property
+    def circuit_breakers(self) -> List[CircuitBreaker]:
+        return list(self._circuit_breakers.values())
+
+    def get_circuit_breaker(self, endpoint: str) -> CircuitBreaker:
+        if endpoint not in self._circuit_breakers:
+            self._circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+
+        return self._circuit_breakers[endpoint]
+
+    def is_available(self, endpoint: str) -> bool:
+        """
+        接口当前是否可用（未熔断）
+        :param endpoint:
+        :return:
+        """
+        return self.get_circuit_breaker(endpoint).state != CIRCUIT_OPEN
 
-    @retry_on_exception(exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+    @retry_on_exception(exceptions=RETRYABLE_EXCEPTIONS, endpoint=REFRESH_TOKEN_API, refresh_on_auth_error=False)
     async def refresh_token(self, refresh_token: str) -> TokenInfo:
         """
         刷新token
@@ -108,7 +216,7 @@ class HaierClient:
 
         headers = await self._generate_common_headers(REFRESH_TOKEN_API, json.dumps(payload))
         async with self._session.post(url=REFRESH_TOKEN_API, headers=headers, json=payload) as response:
-            content = await response.json(content_type=None)
+            content = await self._read_json(response)
             self._assert_response_successful(content)
 
             token_info = content['data']['tokenInfo']
@@ -118,7 +226,7 @@ class HaierClient:
                 token_info['expiresIn']
             )
 
-    @retry_on_exception(exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+    @retry_on_exception(exceptions=RETRYABLE_EXCEPTIONS, endpoint=GET_USER_INFO_API, refresh_on_auth_error=False)
     async def get_user_info(self) -> dict:
         """
         根据token获取用户信息
@@ -128,7 +236,7 @@ class HaierClient:
             'Authorization': f'Bearer {self._token}',
         }
         async with self._session.get(url=GET_USER_INFO_API, headers=headers) as response:
-            content = await response.json(content_type=None)
+            content = await self._read_json(response)
             if 'error_description' in content:
                 raise HaierClientException('Error getting user info, error: {}'.format(content['error_description']))
 
@@ -138,127 +246,252 @@ class HaierClient:
                 'username': content['username']
             }
 
-    @retry_on_exception(exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
-    async def get_devices(self) -> List[HaierDevice]:
+    async def get_devices(self, exclude: Iterable[str] = (), max_age: float = 0) -> List[HaierDevice]:
         """
         获取设备列表
+        :param exclude: 不需要创建的设备ID（如已存在的设备）
+        :param max_age: 允许使用的设备列表缓存最大时长（秒）
         """
-        headers = await self._generate_common_headers(GET_DEVICES_API)
-        async with self._session.get(url=GET_DEVICES_API, headers=headers) as response:
-            content = await response.json(content_type=None)
-            self._assert_response_successful(content)
+        exclude = set(exclude)
+        devices = []
+        for raw in await self._get_device_infos(max_age=max_age):
+            if raw['deviceId'] in exclude:
+                continue
+
+            _LOGGER.debug('Device Info: {}'.format(raw))
+            devices.append(HaierDevice(self, raw))
+
+        started_at = time.monotonic()
+        models = await self.get_digital_models_from_cache(devices)
+
+        # 获取attributes失败的设备本次不创建，之后由设备发现重新尝试，不影响其他设备
+        failed = [device.id for device in devices if device.id not in models]
+        if failed:
+            _LOGGER.warning('Failed to get digital models of devices, will retry later: %s', failed)
+            devices = [device for device in devices if device.id in models]
 
-            devices = []
-            for raw in content['deviceinfos']:
-                _LOGGER.debug('Device Info: {}'.format(raw))
-                device = HaierDevice(self, raw)
-                await device.async_init()
-                devices.append(device)
+        for device in devices:
+            await device.async_init(models[device.id])
+
+        # 包含缓存读写及批量获取digital model的耗时，各设备的缓存读取耗时见缓存日志
+        _LOGGER.info('%s devices initialized in %.3fs', len(devices), time.monotonic() - started_at)
+
+        return devices
+
+    async def _get_device_infos(self, max_age: float = 0) -> List[dict]:
+        """
+        获取原始设备信息列表
+        :param max_age: 允许使用的缓存最大时长（秒），为0时总是从远程获取
+        :return:
+        """
+        if self._device_infos_cache is not None and max_age > 0:
+            cached_at, device_infos = self._device_infos_cache
+            if time.monotonic() - cached_at <= max_age:
+                return device_infos
 
-            return devices
+        device_infos = await self._fetch_device_infos()
+        self._device_infos_cache = (time.monotonic(), device_infos)
+
+        return device_infos
+
+    @retry_on_exception(exceptions=RETRYABLE_EXCEPTIONS, endpoint=GET_DEVICES_API)
+    async def _fetch_device_infos(self) -> List[dict]:
+        content = await self._request('GET', GET_DEVICES_API)
+
+        return content['deviceinfos']
 
-    @retry_on_exception(exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
     async def get_digital_model(self, deviceId: str) -> list:
         """
         获取设备attributes
         :param deviceId:
         :return:
         """
+        models = await self.get_digital_models([deviceId])
+
+        return models.get(deviceId, [])
+
+    async def get_digital_models(
+            self,
+            device_ids: List[str],
+            chunk_size: int = DIGITAL_MODEL_CHUNK_SIZE
+    ) -> Dict[str, list]:
+        """
+        批量获取设备attributes，每次请求最多包含chunk_size个设备
+        :param device_ids:
+        :param chunk_size:
+        :return: 以设备ID为key的attributes，请求失败的设备不会出现在结果中
+        """
+        models = {}
+        for i in range(0, len(device_ids), chunk_size):
+            chunk = device_ids[i:i + chunk_size]
+            try:
+                models.update(await self._get_digital_models_chunk(chunk))
+            except Exception:
+                # 单批失败时保留其他批次的结果
+                _LOGGER.exception('Failed to get digital models of devices: %s', chunk)
+
+        return models
+
+    @retry_on_exception(exceptions=RETRYABLE_EXCEPTIONS, endpoint=GET_DIGITAL_MODEL_API)
+    async def _get_digital_models_chunk(self, device_ids: List[str]) -> Dict[str, list]:
         payload = {
             'deviceInfoList': [
                 {
-                    'deviceId': deviceId
-                }
+                    'deviceId': device_id
+                } for device_id in device_ids
             ]
         }
 
-        headers = await self._generate_common_headers(GET_DIGITAL_MODEL_API, json.dumps(payload))
-        async with self._session.post(url=GET_DIGITAL_MODEL_API, json=payload, headers=headers) as response:
-            content = await response.json(content_type=None)
-            self._assert_response_successful(content)
+        content = await self._request('POST', GET_DIGITAL_MODEL_API, payload)
 
-            if deviceId not in content['detailInfo']:
+        models = {}
+        for device_id in device_ids:
+            if device_id not in content['detailInfo']:
                 _LOGGER.warning("Device {} get digital model fail. response: {}".format(
-                    deviceId,
+                    device_id,
                     json.dumps(content, ensure_ascii=False)
                 ))
-                return []
+                models[device_id] = []
+                continue
+
+            models[device_id] = json.loads(content['detailInfo'][device_id])['attributes']
+
+        return models
+
+    async def get_digital_models_from_cache(
+            self,
+            devices: List[HaierDevice],
+            concurrency: int = DEVICE_INIT_CONCURRENCY
+    ) -> Dict[str, list]:
+        """
+        尝试从缓存中获取设备attributes，缓存未命中的设备会批量从远程获取并保存到缓存中
+        :param devices:
+        :param concurrency: 同时读写缓存的设备数
+        :return: 以设备ID为key的attributes，获取失败的设备不会出现在结果中
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _load(device: HaierDevice):
+            async with semaphore:
+                return await self._load_digital_model_cache(device)
+
+        caches = await asyncio.gather(*[_load(device) for device in devices])
+
+        models = {}
+        missed = []
+        for device, cache in zip(devices, caches):
+            if cache is None:
+                missed.append(device)
+            else:
+                models[device.id] = cache
+
+        if not missed:
+            return models
+
+        remote_models = await self.get_digital_models([device.id for device in missed])
+
+        async def _save(device: HaierDevice):
+            async with semaphore:
+                await self._save_digital_model_cache(device, remote_models[device.id])
 
-            return json.loads(content['detailInfo'][deviceId])['attributes']
+        fetched = [device for device in missed if device.id in remote_models]
+        await asyncio.gather(*[_save(device) for device in fetched])
 
-    async def get_digital_model_from_cache(self, device: HaierDevice) -> list:
+        for device in fetched:
+            models[device.id] = remote_models[device.id]
+
+        return models
+
+    async def _load_digital_model_cache(self, device: HaierDevice) -> list | None:
         """
-        尝试从缓存中获取设备attributes，若获取失败则自动从远程获取并保存到缓存中
+        读取设备attributes缓存
         :param device:
-        :return:
+        :return: 缓存不存在或无效时返回None
         """
-        store = Store(self._hass, 1, 'haier/device_{}.json'.format(device.id))
-        cache = None
+        started_at = time.monotonic()
+        store = self._get_digital_model_store(device)
+        attributes = None
         try:
             cache = await store.async_load()
             if isinstance(cache, str):
                 raise RuntimeError('cache is invalid')
+            attributes = cache['attributes'] if cache else None
         except Exception:
             _LOGGER.warning("Device {} cache is invalid".format(device.id))
-            await store.async_remove()
-            cache = None
-
-        if cache:
-            _LOGGER.info("Device {} get digital model from cache successful".format(device.id))
-            return cache['attributes']
-
-        _LOGGER.info("Device {} get digital model from cache fail, attempt to obtain remotely".format(device.id))
-        attributes = await self.get_digital_model(device.id)
-        await store.async_save({
-            'device': {
-                'name': device.name,
-                'type': device.type,
-                'product_code': device.product_code,
-                'product_name': device.product_name,
-                'wifi_type': device.wifi_type
-            },
-            'attributes': attributes
-        })
+            attributes = None
+            try:
+                await store.async_remove()
+            except Exception:
+                _LOGGER.exception('Device %s remove cache failed', device.id)
+
+        if attributes is None:
+            _LOGGER.info("Device {} get digital model from cache fail, attempt to obtain remotely".format(device.id))
+            return None
+
+        _LOGGER.info("Device {} get digital model from cache successful ({:.3f}s)".format(
+            device.id,
+            time.monotonic() - started_at
+        ))
 
         return attributes
 
-    @retry_on_exception(exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+    async def _save_digital_model_cache(self, device: HaierDevice, attributes: list):
+        try:
+            await self._get_digital_model_store(device).async_save({
+                'device': {
+                    'name': device.name,
+                    'type': device.type,
+                    'product_code': device.product_code,
+                    'product_name': device.product_name,
+                    'wifi_type': device.wifi_type
+                },
+                'attributes': attributes
+            })
+        except Exception:
+            _LOGGER.exception('Device %s save cache failed', device.id)
+
+    def _get_digital_model_store(self, device: HaierDevice) -> Store:
+        return Store(self._hass, 1, 'haier/device_{}.json'.format(device.id))
+
     async def get_device_snapshot_data(self, deviceId: str) -> dict:
         """
         获取指定设备最新的属性数据
         :param deviceId:
         :return:
         """
-        values = {}
+        snapshots = await self.get_devices_snapshot_data([deviceId])
 
-        attributes = await self.get_digital_model(deviceId)
-        # 从attributes中读取实体值
-        for attribute in attributes:
-            if 'value' not in attribute:
-                continue
+        return snapshots.get(deviceId, {})
 
-            values[attribute['name']] = attribute['value']
+    async def get_devices_snapshot_data(self, device_ids: List[str]) -> Dict[str, dict]:
+        """
+        批量获取设备最新的属性数据
+        :param device_ids:
+        :return: 以设备ID为key的属性数据
+        """
+        snapshots = {}
 
-        return values
+        models = await self.get_digital_models(device_ids)
+        for device_id, attributes in models.items():
+            # 从attributes中读取实体值
+            snapshots[device_id] = {
+                attribute['name']: attribute['value'] for attribute in attributes if 'value' in attribute
+            }
+
+        return snapshots
 
-    @retry_on_exception(exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
     async def get_devices_online_status(self) -> Dict[str, bool]:
         """
-        获取所有设备的在线状态
+        获取所有设备的在线状态，短时间内的重复调用会复用设备列表缓存
         :return:
         """
-        headers = await self._generate_common_headers(GET_DEVICES_API)
-        async with self._session.get(url=GET_DEVICES_API, headers=headers) as response:
-            content = await response.json(content_type=None)
-            self._assert_response_successful(content)
-
-            devices = {}
-            for device in content['deviceinfos']:
-                devices[device['deviceId']] = device['online']
+        devices = {}
+        for device in await self._get_device_infos(max_age=DEVICE_INFOS_CACHE_TTL):
+            devices[device['deviceId']] = device['online']
 
-            return devices
+        return devices
 
-    @retry_on_exception(exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+    @retry_on_exception(exceptions=RETRYABLE_EXCEPTIONS, endpoint=GET_WSS_GW_API)
     async def get_device_gateway(self) -> str:
         """
         获取网关地址
@@ -269,12 +502,39 @@ class HaierClient:
             'token': self._token
         }
 
-        headers = await self._generate_common_headers(GET_WSS_GW_API, json.dumps(payload))
-        async with self._session.post(url=GET_WSS_GW_API, json=payload, headers=headers) as response:
-            content = await response.json(content_type=None)
+        content = await self._request('POST', GET_WSS_GW_API, payload)
+
+        return content['agAddr'].replace('http://', 'wss://')
+
+    async def _request(self, method: str, api: str, payload: dict = None) -> dict:
+        """
+        发送签名请求，相同的并发请求（接口、方法、请求体均相同）会合并为一次，结果共享给所有调用方
+        :param method:
+        :param api:
+        :param payload:
+        :return:
+        """
+        body = json.dumps(payload) if payload is not None else ''
+        key = '{} {} {}'.format(method, api, body)
+
+        task = self._in_flight_requests.get(key)
+        if task is None:
+            task = self._hass.async_create_task(self._do_request(method, api, payload, body))
+            self._in_flight_requests[key] = task
+            task.add_done_callback(lambda _: self._in_flight_requests.pop(key, None))
+        else:
+            _LOGGER.debug('Join in-flight request: %s %s', method, api)
+
+        # shield：单个调用方被取消时不影响其他等待同一请求的调用方
+        return await asyncio.shield(task)
+
+    async def _do_request(self, method: str, api: str, payload: dict | None, body: str) -> dict:
+        headers = await self._generate_common_headers(api, body)
+        async with self._session.request(method, url=api, json=payload, headers=headers) as response:
+            content = await self._read_json(response)
             self._assert_response_successful(content)
 
-            return content['agAddr'].replace('http://', 'wss://')
+            return content
 
     async def _generate_common_headers(self, api, body=''):
         """
@@ -301,9 +561,30 @@ class HaierClient:
             'language': 'zh-CN'
         }
 
+    @staticmethod
+    async def _read_json(response: aiohttp.ClientResponse) -> dict:
+        """
+        读取响应内容，服务端繁忙时抛出可重试的异常
+        :param response:
+        :return:
+        """
+        if response.status == 401:
+            raise HaierAuthException('token无效或已过期')
+
+        if response.status == 429 or response.status >= 500:
+            raise HaierServerBusyException(
+                '接口返回异常状态码: {}'.format(response.status),
+                parse_retry_after(response.headers.get('Retry-After'))
+            )
+
+        return await response.json(content_type=None)
+
     @staticmethod
     def _assert_response_successful(resp):
         if 'retCode' in resp and resp['retCode'] != '00000':
+            if resp['retCode'] in AUTH_ERROR_RET_CODES:
+                raise HaierAuthException('接口返回异常: ' + resp['retInfo'])
+
             raise HaierClientException('接口返回异常: ' + resp['retInfo'])
 
     @staticmethod
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from homeassistant.core import HomeAssistant, callback
+
+_LOGGER = logging.getLogger(__name__)
+
+# 合并控制命令的时间窗口（秒）
+COMMAND_BATCH_WINDOW = 0.05
+# 单个BatchCmdReq中最多包含的命令数
+COMMAND_BATCH_MAX_SIZE = 20
+
+# 刷新命令，不与普通控制命令合并
+GET_ALL_PROPERTY_COMMAND = 'getAllProperty'
+
+
+class CommandBatcher:
+    """
+    在短时间窗口内收集控制命令：同一设备的多次写入合并为一条命令，
+    多个设备的命令合并到同一个BatchCmdReq中下发
+    """
+
+    def __init__(
+            self,
+            hass: HomeAssistant,
+            send: Callable[[List[Tuple[str, dict]]], Awaitable[asyncio.Future]],
+            window: float = COMMAND_BATCH_WINDOW,
+            max_size: int = COMMAND_BATCH_MAX_SIZE
+    ):
+        """
+        :param hass:
+        :param send: 发送一个BatchCmdReq，返回网关确认该请求时完成的future
+        :param window:
+        :param max_size:
+        """
+        self._hass = hass
+        self._send = send
+        self._window = window
+        self._max_size = max_size
+        # 设备ID -> 该设备待下发的命令及等待确认的future，保持加入顺序
+        self._pending: Dict[str, List[Tuple[dict, List[asyncio.Future]]]] = {}
+        self._flush_handle = None
+
+    @callback
+    def add(self, device_id: str, attributes: dict) -> asyncio.Future:
+        """
+        加入一条命令，窗口结束后统一下发
+        :param device_id:
+        :param attributes:
+        :return: 网关确认该命令时完成的future
+        """
+        waiter = self._hass.loop.create_future()
+        waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        commands = self._pending.setdefault(device_id, [])
+        if commands and not self._is_refresh(commands[-1][0]) and not self._is_refresh(attributes):
+            # 同一设备的多次写入合并，后写入的值覆盖先写入的值
+            commands[-1][0].update(attributes)
+            commands[-1][1].append(waiter)
+        else:
+            commands.append((dict(attributes), [waiter]))
+
+        if self._flush_handle is None:
+            self._flush_handle = self._hass.loop.call_later(self._window, self._schedule_flush)
+
+        return waiter
+
+    @callback
+    def cancel(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._pending:
+            _LOGGER.warning('Dropped pending commands of devices: %s', list(self._pending.keys()))
+            for items in self._pending.values():
+                for _, waiters in items:
+                    self._set_exception(waiters, ConnectionError('device gateway disconnected'))
+            self._pending = {}
+
+    @callback
+    def _schedule_flush(self):
+        self._flush_handle = None
+        self._hass.async_create_task(self.flush())
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+
+        commands = [
+            (device_id, attributes, waiters)
+            for device_id, items in pending.items()
+            for attributes, waiters in items
+        ]
+        for i in range(0, len(commands), self._max_size):
+            batch = commands[i:i + self._max_size]
+            waiters = [waiter for _, _, items in batch for waiter in items]
+            try:
+                ack = await self._send([(device_id, attributes) for device_id, attributes, _ in batch])
+            except Exception as e:
+                _LOGGER.exception('Failed to send commands: %s', [(device_id, attributes) for device_id, attributes, _ in batch])
+                self._set_exception(waiters, e)
+                continue
+
+            ack.add_done_callback(lambda f, items=waiters: self._chain(f, items))
+
+    @staticmethod
+    def _chain(ack: asyncio.Future, waiters: List[asyncio.Future]):
+        if ack.cancelled():
+            for waiter in waiters:
+                waiter.cancel()
+            return
+
+        if ack.exception() is not None:
+            CommandBatcher._set_exception(waiters, ack.exception())
+            return
+
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(ack.result())
+
+    @staticmethod
+    def _set_exception(waiters: List[asyncio.Future], exception: BaseException):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(exception)
+
+    @staticmethod
+    def _is_refresh(attributes: dict) -> bool:
+        return GET_ALL_PROPERTY_COMMAND in attributes
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Iterable, List
+
+from homeassistant.core import HomeAssistant, callback
+
+_LOGGER = logging.getLogger(__name__)
+
+# 等待网关确认命令的时长（秒）
+COMMAND_ACK_TIMEOUT = 10
+# 每个设备/产品保留的延迟样本数
+LATENCY_SAMPLE_SIZE = 100
+
+
+class CommandTracker:
+    """
+    按sn跟踪已下发的命令，收到网关响应时完成对应的future，并统计发送到确认的延迟
+    """
+
+    def __init__(self, hass: HomeAssistant, timeout: float = COMMAND_ACK_TIMEOUT):
+        self._hass = hass
+        self._timeout = timeout
+        # sn -> (future, 发送时间, 设备ID列表, 超时回调句柄)
+        self._pending: Dict[str, tuple] = {}
+        self._device_latencies: Dict[str, deque] = {}
+        self._product_latencies: Dict[str, deque] = {}
+        self._products: Dict[str, str] = {}
+        self._timeouts = 0
+
+    @callback
+    def track(self, sn: str, device_ids: List[str], products: Dict[str, str] = None) -> asyncio.Future:
+        """
+        登记已下发的命令
+        :param sn:
+        :param device_ids: 命令涉及的设备
+        :param products: 设备ID -> 产品名称，用于按产品统计延迟
+        :return: 收到响应时完成的future，超时则抛出asyncio.TimeoutError
+        """
+        if products:
+            self._products.update(products)
+
+        future = self._hass.loop.create_future()
+        # 没有调用方等待时避免出现 "exception was never retrieved" 日志
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        handle = self._hass.loop.call_later(self._timeout, self._on_timeout, sn)
+        self._pending[sn] = (future, time.monotonic(), device_ids, handle)
+
+        return future
+
+    @callback
+    def resolve(self, sn: str, response: dict) -> bool:
+        """
+        收到网关响应
+        :param sn:
+        :param response:
+        :return: 是否为已登记的命令
+        """
+        entry = self._pending.pop(sn, None)
+        if entry is None:
+            return False
+
+        future, sent_at, device_ids, handle = entry
+        handle.cancel()
+
+        latency = time.monotonic() - sent_at
+        for device_id in device_ids:
+            self._device_latencies.setdefault(device_id, deque(maxlen=LATENCY_SAMPLE_SIZE)).append(latency)
+            product = self._products.get(device_id)
+            if product:
+                self._product_latencies.setdefault(product, deque(maxlen=LATENCY_SAMPLE_SIZE)).append(latency)
+
+        if not future.done():
+            future.set_result(response)
+
+        return True
+
+    @callback
+    def discard(self, sn: str):
+        """
+        撤销登记（如命令未能发出）
+        :param sn:
+        :return:
+        """
+        entry = self._pending.pop(sn, None)
+        if entry is None:
+            return
+
+        future, _, _, handle = entry
+        handle.cancel()
+        if not future.done():
+            future.cancel()
+
+    @callback
+    def cancel(self, device_ids: Iterable[str] = None):
+        """
+        连接断开时取消等待中的命令
+        :param device_ids: 只取消涉及这些设备的命令，为None时取消全部
+        :return:
+        """
+        if device_ids is None:
+            sns = list(self._pending.keys())
+        else:
+            device_ids = set(device_ids)
+            sns = [sn for sn, entry in self._pending.items() if not device_ids.isdisjoint(entry[2])]
+
+        for sn in sns:
+            future, _, _, handle = self._pending.pop(sn)
+            handle.cancel()
+            if not future.done():
+                future.set_exception(ConnectionError('device gateway disconnected'))
+
+    @callback
+    def _on_timeout(self, sn: str):
+        entry = self._pending.pop(sn, None)
+        if entry is None:
+            return
+
+        future, _, device_ids, _ = entry
+        self._timeouts += 1
+        _LOGGER.debug('Command %s of devices %s not acknowledged in %ss', sn, device_ids, self._timeout)
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError())
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'timeouts': self._timeouts,
+            'devices': {key: self._percentiles(value) for key, value in self._device_latencies.items()},
+            'products': {key: self._percentiles(value) for key, value in self._product_latencies.items()},
+        }
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        values = sorted(samples)
+
+        def percentile(p):
+            return round(values[min(len(values) - 1, int(len(values) * p))], 3)
+
+        return {
+            'count': len(values),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+        }
@@ -1,10 +1,11 @@
 import time
-from typing import List
+from typing import Dict, List
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
 
-from custom_components.haier.const import FILTER_TYPE_EXCLUDE, FILTER_TYPE_INCLUDE
+from ..const import FILTER_TYPE_EXCLUDE, FILTER_TYPE_INCLUDE, INIT_MODE_REST, INIT_MODE_WEBSOCKET, \
+    DEFAULT_WRITE_DEBOUNCE, DEFAULT_REFRESH_INTERVALS
 
 
 class AccountConfig:
@@ -193,3 +194,84 @@ class EntityFilterConfig:
             'filter_type': filter_type,
             'target_entities': entities
         }
+
+
+class AdvancedConfig:
+    """
+    高级设置
+    """
+
+    init_mode: str = None
+
+    wait_command_ack: bool = None
+
+    optimistic_update: bool = None
+
+    write_debounce: float = None
+
+    refresh_intervals: Dict[str, int] = None
+
+    connection_shards: int = None
+
+    def __init__(self, hass: HomeAssistant, config: ConfigEntry):
+        self._hass = hass
+        self._config = config
+
+        cfg = config.data.get('advanced', {})
+        self.init_mode = cfg.get('init_mode', INIT_MODE_REST)
+        self.wait_command_ack = cfg.get('wait_command_ack', False)
+        self.optimistic_update = cfg.get('optimistic_update', False)
+        self.write_debounce = cfg.get('write_debounce', DEFAULT_WRITE_DEBOUNCE)
+        self.refresh_intervals = cfg.get('refresh_intervals', DEFAULT_REFRESH_INTERVALS)
+        self.connection_shards = cfg.get('connection_shards', 1)
+
+    def save(self):
+        if self.init_mode not in [INIT_MODE_REST, INIT_MODE_WEBSOCKET]:
+            raise ValueError()
+
+        for interval in self.refresh_intervals.values():
+            if not isinstance(interval, int) or interval <= 0:
+                raise ValueError()
+
+        if self.connection_shards < 1:
+            raise ValueError()
+
+        self._hass.config_entries.async_update_entry(
+            self._config,
+            data={
+                **self._config.data,
+                'advanced': {
+                    'init_mode': self.init_mode,
+                    'wait_command_ack': self.wait_command_ack,
+                    'optimistic_update': self.optimistic_update,
+                    'write_debounce': self.write_debounce,
+                    'refresh_intervals': self.refresh_intervals,
+                    'connection_shards': self.connection_shards
+                }
+            }
+        )
+
+    @staticmethod
+    def format_refresh_intervals(intervals: Dict[str, int]) -> str:
+        return ', '.join('{}={}'.format(name, interval) for name, interval in intervals.items())
+
+    @staticmethod
+    def parse_refresh_intervals(value: str) -> Dict[str, int]:
+        """
+        解析 "产品名称=间隔秒数" 格式的配置，多个产品之间使用逗号或换行分隔
+        :param value:
+        :return:
+        """
+        intervals = {}
+        for item in value.replace('\n', ',').split(','):
+            if not item.strip():
+                continue
+
+            name, interval = item.split('=')
+            interval = int(interval.strip())
+            if not name.strip() or interval <= 0:
+                raise ValueError()
+
+            intervals[name.strip()] = interval
+
+        return intervals
@@ -0,0 +1,90 @@
+import base64
+import json
+import logging
+import time
+import zlib
+from collections import deque
+from typing import List, Tuple
+
+from homeassistant.core import HomeAssistant
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+_LOGGER = logging.getLogger(__name__)
+
+# 压缩后数据超过该长度（base64字符数）时放到executor中解码，避免阻塞事件循环
+DECODE_EXECUTOR_THRESHOLD = 32 * 1024
+# 保留的解码耗时样本数
+DECODE_SAMPLE_SIZE = 100
+
+
+def decode_digital_model_args(args: str) -> List[Tuple[str, str]]:
+    """
+    解码DigitalModel消息中的args，只提取attributes的name和value
+    :param args: base64编码的gzip数据
+    :return: (name, value) 列表
+    """
+    model = json_loads(zlib.decompress(base64.b64decode(args), 16 + zlib.MAX_WBITS))
+
+    # {
+    #     "alarms": [],
+    #     "attributes": [
+    #         {
+    #             "defaultValue": "35",
+    #             "desc": "目标温度",
+    #             "name": "targetTemp",
+    #             "value": "40",
+    #             "valueRange": {...},
+    #             "writable": true
+    #         }
+    #         ....
+    #     ],
+    #     "businessAttr": []
+    # }
+    # 有些attribute没有value字段。。。
+    return [(attribute['name'], attribute['value']) for attribute in model['attributes'] if 'value' in attribute]
+
+
+class FrameDecoder:
+    """
+    GenMsgDown消息解码，较大的数据放到executor中处理，并统计每帧的解码耗时
+    """
+
+    def __init__(self, hass: HomeAssistant, threshold: int = DECODE_EXECUTOR_THRESHOLD):
+        self._hass = hass
+        self._threshold = threshold
+        self._durations = deque(maxlen=DECODE_SAMPLE_SIZE)
+        self._frames = 0
+        self._offloaded = 0
+
+    async def decode_digital_model(self, args: str) -> List[Tuple[str, str]]:
+        started_at = time.perf_counter()
+
+        if len(args) > self._threshold:
+            self._offloaded += 1
+            values = await self._hass.async_add_executor_job(decode_digital_model_args, args)
+        else:
+            values = decode_digital_model_args(args)
+
+        duration = time.perf_counter() - started_at
+        self._frames += 1
+        self._durations.append(duration)
+        _LOGGER.debug('Decoded digital model of %s bytes in %.2fms', len(args), duration * 1000)
+
+        return values
+
+    def stats(self) -> dict:
+        durations = sorted(self._durations)
+
+        return {
+            'backend': json_loads.__module__,
+            'frames': self._frames,
+            'offloaded': self._offloaded,
+            'avg_ms': round(sum(durations) / len(durations) * 1000, 3) if durations else None,
+            'max_ms': round(durations[-1] * 1000, 3) if durations else None,
+        }
@@ -3,6 +3,7 @@ import logging
 from typing import List
 
 from .attribute import HaierAttribute, V1SpecAttributeParser
+from .device_state import DeviceState
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -15,6 +16,10 @@ class HaierDevice:
         self._client = client
         self._raw_data = raw
         self._attributes = []
+        self._state = DeviceState()
+        if isinstance(raw.get('online'), bool):
+            self._state.set_online(raw['online'])
+        self._suppressed_writes = 0
 
     @property
     def id(self):
@@ -44,12 +49,31 @@ class HaierDevice:
     def attributes(self) -> List[HaierAttribute]:
         return self._attributes
 
-    async def async_init(self):
+    @property
+    def state(self) -> DeviceState:
+        return self._state
+
+    @property
+    def suppressed_writes(self) -> int:
+        """
+        因与当前状态一致而未下发的写入次数
+        :return:
+        """
+        return self._suppressed_writes
+
+    def record_suppressed_write(self):
+        self._suppressed_writes += 1
+
+    async def async_init(self, attributes: List[dict]):
+        """
+        根据digital model中的attributes初始化设备
+        :param attributes:
+        :return:
+        """
         # 解析Attribute
         # noinspection PyBroadException
         try:
             parser = V1SpecAttributeParser()
-            attributes = await self._client.get_digital_model_from_cache(self)
             for item in attributes:
                 try:
                     attr = parser.parse_attribute(item)
@@ -1,41 +1,127 @@
 import asyncio
 import base64
-import json
 import logging
-import random
-import zlib
-from datetime import timedelta
-from typing import List
+import time
+from typing import List, Dict, Tuple
 
-import aiohttp
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
-from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.core import HomeAssistant, callback
 
-from .client import HaierClient
+from ..const import INIT_MODE_REST, DEFAULT_REFRESH_INTERVALS
+from .client import HaierClient, GET_DIGITAL_MODEL_API, DIGITAL_MODEL_CHUNK_SIZE
+from .command_tracker import CommandTracker
+from .decoder import FrameDecoder, json_loads
+from .frame_filter import FrameFilter, SUPPRESSED_DUPLICATE_CONTENT
 from .device import HaierDevice
+from .gateway_connection import GatewayConnection, random_str
+from .ws_writer import WebSocketWriter, PRIORITY_COMMAND, PRIORITY_REFRESH
 from .event import EVENT_DEVICE_CONTROL, EVENT_DEVICE_DATA_CHANGED, EVENT_GATEWAY_DISCONNECTED, \
     EVENT_DEVICE_ONLINE_CHANGED
-from .event import listen_event, fire_event
+from .event import listen_event, fire_device_event
 
 _LOGGER = logging.getLogger(__name__)
 
-FORCE_REFRESH_PRODUCT_NAMES = [
-    'JSQ30-16R3BWU1'
-]
-
-
-def random_str(length: int = 32) -> str:
-    return ''.join(random.choice('abcdef1234567890') for _ in range(length))
+# 同时拉取快照数据的请求数
+RESYNC_CONCURRENCY = 2
 
 
 class HaierDeviceGateway:
-
-    def __init__(self, hass: HomeAssistant, client: HaierClient, token: str):
+    """
+    设备网关：设备可分布在多条websocket连接上，所有连接收到的消息经同一路径分发到HA
+    """
+
+    def __init__(
+            self,
+            hass: HomeAssistant,
+            client: HaierClient,
+            token: str,
+            init_mode: str = INIT_MODE_REST,
+            wait_command_ack: bool = False,
+            refresh_intervals: Dict[str, int] = None,
+            connection_shards: int = 1
+    ):
         self._hass = hass
         self._client = client
         self._token = token
-        self._session = async_get_clientsession(hass)
+        self._init_mode = init_mode
+        self._wait_command_ack = wait_command_ack
+        # 产品名称 -> 定时发送刷新命令的间隔（秒）
+        self._refresh_intervals = DEFAULT_REFRESH_INTERVALS if refresh_intervals is None else refresh_intervals
+        self._connection_shards = max(1, connection_shards)
+        self._tracker = CommandTracker(hass)
+        # 刷新请求单独统计，避免与控制命令的确认延迟混在一起
+        self._refresh_tracker = CommandTracker(hass)
+        self._decoder = FrameDecoder(hass)
+        self._frame_filter = FrameFilter()
+        self._devices: Dict[str, HaierDevice] = {}
+        self._connections: List[GatewayConnection] = []
+        # 设备ID -> 该设备所在的连接
+        self._device_connections: Dict[str, GatewayConnection] = {}
+        self._resync_queue: asyncio.Queue = asyncio.Queue()
+        self._resync_pending: Dict[str, float] = {}
+
+    @property
+    def token(self) -> str:
+        return self._token
+
+    @property
+    def init_mode(self) -> str:
+        return self._init_mode
+
+    @property
+    def refresh_intervals(self) -> Dict[str, int]:
+        return self._refresh_intervals
+
+    async def update_token(self, token: str):
+        """
+        更新token，所有连接会主动断开并使用新token重连，期间实体保持可用且不会重新拉取数据
+        :param token:
+        :return:
+        """
+        self._token = token
+
+        _LOGGER.info('token changed, reconnecting device gateway...')
+        for connection in self._connections:
+            await connection.rotate_token()
+
+    @property
+    def command_stats(self) -> dict:
+        """
+        命令确认情况及发送到确认的延迟统计
+        :return:
+        """
+        return self._tracker.stats()
+
+    @property
+    def refresh_stats(self) -> dict:
+        """
+        刷新请求（getAllProperty）的确认情况及延迟统计
+        :return:
+        """
+        return self._refresh_tracker.stats()
+
+    @property
+    def suppressed_frames(self) -> dict:
+        """
+        被丢弃的重复消息及过期快照数
+        :return:
+        """
+        return self._frame_filter.stats()
+
+    @property
+    def decode_stats(self) -> dict:
+        """
+        GenMsgDown消息解码耗时统计
+        :return:
+        """
+        return self._decoder.stats()
+
+    @property
+    def connection_stats(self) -> List[dict]:
+        """
+        各连接的状态、发送队列及最近的连接记录
+        :return:
+        """
+        return [connection.stats() for connection in self._connections]
 
     async def connect(self, target_devices: List[HaierDevice]):
         """
@@ -43,120 +129,201 @@ class HaierDeviceGateway:
         :param target_devices:  需要监听数据变化的设备
         :return:
         """
-        while True:
+        # 连接建立前发现的设备也一并分配
+        target_ids = {device.id for device in target_devices}
+        target_devices = target_devices + [
+            device for device_id, device in self._devices.items() if device_id not in target_ids
+        ]
+        self._devices = {device.id: device for device in target_devices}
+
+        # 设备依次分配到各连接上
+        shards = max(1, min(self._connection_shards, len(target_devices)))
+        self._connections = [
+            GatewayConnection(self._hass, self, self._client, index, target_devices[index::shards])
+            for index in range(shards)
+        ]
+        self._device_connections = {
+            device.id: connection for connection in self._connections for device in connection.devices
+        }
+        if shards > 1:
+            _LOGGER.info('{} devices are split across {} gateway connections'.format(len(target_devices), shards))
+
+        # 监听事件总线来的控制命令
+        @callback
+        def control_callback(e):
             try:
-                await self._connect(target_devices)
-            except asyncio.CancelledError:
-                _LOGGER.debug("device gateway stopped")
-                return
-            except:
-                _LOGGER.exception("device gateway disconnected. Waiting to retry.")
-                await asyncio.sleep(30)
+                self._add_command(e.data['deviceId'], e.data['attributes'])
+            except ConnectionError:
+                _LOGGER.warning('Device [{}] command dropped, gateway is not connected'.format(e.data['deviceId']))
 
-    async def _connect(self, target_devices: List[HaierDevice]):
-        server = await self._client.get_device_gateway()
-        _LOGGER.debug('device gateway: {}'.format(server))
+        cancel_control_listener = listen_event(self._hass, EVENT_DEVICE_CONTROL, control_callback)
 
-        agClientId = self._token
-        cancels = []
+        workers = [
+            self._hass.async_create_background_task(self._resync_worker(), 'haier-resync-{}'.format(i))
+            for i in range(RESYNC_CONCURRENCY)
+        ]
         try:
-            url = '{}/userag?token={}&agClientId={}'.format(server, self._token, agClientId)
-            async with self._session.ws_connect(url) as ws:
-                _LOGGER.debug('device gateway connected')
-
-                # 订阅设备状态
-                await ws.send_str(json.dumps({
-                    'agClientId': agClientId,
-                    'topic': 'BoundDevs',
-                    'content': {
-                        'devs': [device.id for device in target_devices]
-                    }
-                }))
-
-                # 定期发送心跳包
-                cancels.append(await self._start_heartbeat_sender(ws, agClientId))
-
-                # 对于部分设备需要定时发送刷新命令以保持数据更新
-                force_refresh_devices = [d for d in target_devices if d.product_name in FORCE_REFRESH_PRODUCT_NAMES]
-                if force_refresh_devices:
-                    cancels.append(
-                        await self._start_force_refresh_property_tracker(ws, agClientId, force_refresh_devices)
-                    )
-
-                # 监听事件总线来的控制命令
-                async def control_callback(e):
-                    await self._send_command(ws, agClientId, e.data['deviceId'], e.data['attributes'])
-
-                cancels.append(listen_event(self._hass, EVENT_DEVICE_CONTROL, control_callback))
-
-                # 网关只会在设备数据有变更的时候才会下发数据，所以刚连上网关时需要手动拉取一下数据
-                await self._init_devices(target_devices)
-
-                async for msg in ws:
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        await self._parse_message(msg.data)
-                    elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING):
-                        raise RuntimeError("WebSocket 连接已关闭")
-                    elif msg.type == aiohttp.WSMsgType.ERROR:
-                        raise RuntimeError(f"WebSocket 连接发生异常: {ws.exception()}")
-                    else:
-                        _LOGGER.warning("收到未知类型的消息: {}".format(msg.type))
+            await asyncio.gather(*[connection.run() for connection in self._connections])
         finally:
-            fire_event(self._hass, EVENT_GATEWAY_DISCONNECTED, {})
-            for cancel in cancels:
-                cancel()
+            cancel_control_listener()
+            for worker in workers:
+                worker.cancel()
 
-    async def _start_heartbeat_sender(self, ws, agClientId: str):
-        async def task(now):
-            try:
-                await ws.send_str(json.dumps({
-                    'agClientId': agClientId,
-                    'topic': 'HeartBeat',
-                    'content': {
-                        'sn': random_str(32),
-                        'duration': 0
-                    }
-                }))
-
-                _LOGGER.debug('Sending heartbeat')
-            except Exception:
-                _LOGGER.exception('Failed to send heartbeat')
+    async def async_add_devices(self, devices: List[HaierDevice]):
+        """
+        加入新发现的设备，分配到设备数最少的连接上，其他设备不受影响
+        :param devices:
+        :return:
+        """
+        for device in devices:
+            self._devices[device.id] = device
 
-        return async_track_time_interval(self._hass, task, timedelta(seconds=60))
+        # 尚未建立连接时只记录设备，建立连接时统一分配
+        if not self._connections:
+            return
 
-    async def _start_force_refresh_property_tracker(self, ws, agClientId: str, devices: List[HaierDevice]):
-        async def task(now):
-            for device in devices:
-                try:
-                    await self._send_command(ws, agClientId, device.id, {'getAllProperty': 'getAllProperty'})
-                    _LOGGER.debug('Sent force refresh command to device: %s', device.id)
-                except Exception:
-                    _LOGGER.exception('Failed to send force refresh to device: %s', device.id)
+        groups: Dict[int, List[HaierDevice]] = {}
+        for device in devices:
+            index = min(range(len(self._connections)), key=lambda i: (
+                len(self._connections[i].devices) + len(groups.get(i, []))
+            ))
+            groups.setdefault(index, []).append(device)
+            self._device_connections[device.id] = self._connections[index]
 
-        return async_track_time_interval(self._hass, task, timedelta(seconds=60))
+        for index, group in groups.items():
+            await self._connections[index].async_add_devices(group)
 
-    async def _init_devices(self, target_devices: List[HaierDevice]):
-        device_online_statues = await self._client.get_devices_online_status()
+    @callback
+    def remove_devices(self, device_ids: List[str]):
+        """
+        移除已不存在的设备，之后收到的该设备消息会被忽略
+        :param device_ids:
+        :return:
+        """
+        for device_id in device_ids:
+            self._devices.pop(device_id, None)
+            connection = self._device_connections.pop(device_id, None)
+            if connection is not None:
+                connection.remove_devices([device_id])
+
+    @callback
+    def connection_closed(self, devices: List[HaierDevice], token_rotating: bool):
+        """
+        某条连接断开
+        :param devices: 该连接上的设备
+        :param token_rotating: 是否因token轮换而主动断开
+        :return:
+        """
+        device_ids = [device.id for device in devices]
+        self._tracker.cancel(device_ids)
+        self._refresh_tracker.cancel(device_ids)
 
-        async def _fetch_snapshot(device):
-            # 跳过已离线的设备
-            if device.id in device_online_statues and device_online_statues[device.id] is False:
-                return
+        if token_rotating:
+            return
 
-            _LOGGER.debug("Fetching snapshot data for device: %s", device.id)
+        # 断线后实体均为不可用状态，重连后需要全量刷新
+        for device in devices:
+            device.state.mark_unsynced()
+        self._frame_filter.clear(device_ids)
 
-            snapshot_data = await self._client.get_device_snapshot_data(device.id)
-            fire_event(self._hass, EVENT_DEVICE_DATA_CHANGED, {
-                'deviceId': device.id,
-                'attributes': snapshot_data
+        # 只通知该连接上设备的实体
+        for device_id in device_ids:
+            fire_device_event(self._hass, EVENT_GATEWAY_DISCONNECTED, device_id, {
+                'deviceId': device_id
             })
 
-        await asyncio.gather(*[_fetch_snapshot(d) for d in target_devices], return_exceptions=True)
+    def request_resync(self, device_ids: List[str], force: bool = False):
+        """
+        将设备加入重新同步队列，已在队列中的设备不会重复加入
+        :param device_ids:
+        :param force: 为True时即使设备之后收到过数据也要拉取（如设备重新上线）
+        :return:
+        """
+        # 加入时间设为无穷大，拉取前的"加入后已收到数据"检查恒不成立
+        now = float('inf') if force else time.time()
+        for device_id in device_ids:
+            if device_id in self._resync_pending:
+                self._resync_pending[device_id] = max(self._resync_pending[device_id], now)
+                continue
+
+            self._resync_pending[device_id] = now
+            self._resync_queue.put_nowait(device_id)
+
+    async def _resync_worker(self):
+        """
+        从队列中取出设备批量拉取快照数据，同时运行的worker数量即并发请求数上限
+        :return:
+        """
+        while True:
+            device_ids = [await self._resync_queue.get()]
+            while len(device_ids) < DIGITAL_MODEL_CHUNK_SIZE and not self._resync_queue.empty():
+                device_ids.append(self._resync_queue.get_nowait())
+
+            try:
+                await self._resync(device_ids)
+            except Exception:
+                _LOGGER.exception('Failed to fetch snapshot data')
+            finally:
+                for device_id in device_ids:
+                    self._resync_pending.pop(device_id, None)
+
+    async def _resync(self, device_ids: List[str]):
+        # 加入队列后已经通过websocket收到数据的设备及已离线的设备无需再拉取
+        device_ids = [
+            device_id for device_id in device_ids
+            if device_id in self._devices
+            and self._devices[device_id].state.online is not False
+            and not self.is_updated_since(device_id, self._resync_pending[device_id])
+        ]
+        if not device_ids:
+            return
 
-    async def _parse_message(self, msg):
-        msg = json.loads(msg)
+        # 接口熔断期间请求必然失败，直接跳过
+        if not self._client.is_available(GET_DIGITAL_MODEL_API):
+            _LOGGER.warning('Digital model api is unavailable, skip fetching snapshot data')
+            return
+
+        _LOGGER.debug("Fetching snapshot data for devices: %s", device_ids)
+
+        requested_at = time.time()
+        snapshots = await self._client.get_devices_snapshot_data(device_ids)
+        for device_id, snapshot_data in snapshots.items():
+            # 请求期间已通过websocket收到更新的数据，快照已过期
+            if self.is_updated_since(device_id, requested_at):
+                _LOGGER.debug('Device [%s] updated during snapshot request, discard snapshot', device_id)
+                self._frame_filter.record_stale_snapshot()
+                continue
+
+            self._frame_filter.reset(device_id)
+            self._dispatch_device_data(device_id, snapshot_data.items())
+
+    def is_updated_since(self, device_id: str, timestamp: float) -> bool:
+        updated_at = self._devices[device_id].state.updated_at
+
+        return updated_at is not None and updated_at >= timestamp and self._devices[device_id].state.synced
+
+    async def dispatch_message(self, connection: GatewayConnection, msg):
+        """
+        处理各连接收到的消息
+        :param connection: 收到消息的连接
+        :param msg:
+        :return:
+        """
+        msg = json_loads(msg)
         if msg['topic'] != 'GenMsgDown':
-            _LOGGER.debug('Received websocket data: ' + json.dumps(msg))
+            # 命令响应
+            content = msg.get('content')
+            if isinstance(content, dict) and connection.is_heartbeat_reply(content.get('sn')):
+                return
+
+            if isinstance(content, dict) and 'sn' in content and (
+                    self._tracker.resolve(content['sn'], content) or
+                    self._refresh_tracker.resolve(content['sn'], content)
+            ):
+                _LOGGER.debug('Command %s acknowledged: %s', content['sn'], msg)
+                return
+
+            _LOGGER.debug('Received websocket data: %s', msg)
             return
 
         # {
@@ -170,99 +337,139 @@ class HaierDeviceGateway:
         #     }
         # }
 
-        data = base64.b64decode(msg['content']['data'])
-        data = json.loads(data)
+        data = json_loads(base64.b64decode(msg['content']['data']))
 
         # 设备attributes数据变动
         if msg['content']['businType'] == 'DigitalModel':
+            # 云端可能重复投递同一条消息
+            reason = self._frame_filter.check(data['dev'], msg['content'].get('sn'), data['args'])
+            if reason is not None:
+                # 内容重复的新消息说明设备刚上报过，只是数据没有变化
+                if reason == SUPPRESSED_DUPLICATE_CONTENT and data['dev'] in self._devices:
+                    self._devices[data['dev']].state.touch()
+
+                _LOGGER.debug('Device [%s] %s frame %s dropped', data['dev'], reason, msg['content'].get('sn'))
+                return
+
             await self._process_digital_model(data)
             return
 
         # 设备在线/离线监听
         if msg['content']['businType'] in ('DevOfflineNotify', 'DevOnlineNotify'):
+            online = msg['content']['businType'] == 'DevOnlineNotify'
+            came_online = []
             for device_id in data['devs']:
-                fire_event(self._hass, EVENT_DEVICE_ONLINE_CHANGED, {
+                if device_id in self._devices and self._devices[device_id].state.set_online(online):
+                    came_online.append(device_id)
+
+                fire_device_event(self._hass, EVENT_DEVICE_ONLINE_CHANGED, device_id, {
                     'deviceId': device_id,
-                    'online': msg['content']['businType'] == 'DevOnlineNotify'
+                    'online': online
                 })
+
+            # 离线期间的数据变化不会推送，设备上线后单独拉取一次快照
+            if came_online:
+                _LOGGER.debug('Devices came online, fetching snapshot data: %s', came_online)
+                self.request_resync(came_online, force=True)
             return
 
-        _LOGGER.debug('Received websocket data: ' + json.dumps(msg))
+        _LOGGER.debug('Received websocket data: %s', msg)
 
     async def _process_digital_model(self, data):
         # {
         #     "args": "xxxxxxx",
         #     "dev": "deviceId.."
         # }
-        deviceId = data['dev']
-        data = zlib.decompress(base64.b64decode(data['args']), 16 + zlib.MAX_WBITS)
-        data = json.loads(data.decode('utf-8'))
+        # args解压后为设备完整的digital model，只取其中attributes的name和value
+        values = await self._decoder.decode_digital_model(data['args'])
+        self._dispatch_device_data(data['dev'], values)
 
-        # {
-        #     "alarms": [],
-        #     "attributes": [
-        #         {
-        #             "defaultValue": "35",
-        #             "desc": "目标温度",
-        #             "invisible": false,
-        #             "name": "targetTemp",
-        #             "operationType": "IG",
-        #             "readable": true,
-        #             "value": "40",
-        #             "valueRange": {
-        #                 "dataStep": {
-        #                     "dataType": "Integer",
-        #                     "maxValue": "60",
-        #                     "minValue": "35",
-        #                     "step": "1"
-        #                 },
-        #                 "type": "STEP"
-        #             },
-        #             "writable": true
-        #         }
-        #         ....
-        #     ],
-        #     "businessAttr": []
-        # }
-        attributes = {}
-        for attribute in data['attributes']:
-            # 有些attribute没有value字段。。。
-            if 'value' not in attribute:
-                continue
+    def _dispatch_device_data(self, device_id: str, values):
+        """
+        写入设备状态，仅在有key发生变化时才通知实体
+        :param device_id:
+        :param values: (key, value) 序列
+        :return:
+        """
+        device = self._devices.get(device_id)
+        if device is None:
+            _LOGGER.debug('Received data of unknown device: %s', device_id)
+            return
 
-            attributes[attribute['name']] = attribute['value']
+        changed = device.state.update(values)
+        if not changed:
+            return
 
-        fire_event(self._hass, EVENT_DEVICE_DATA_CHANGED, {
-            'deviceId': deviceId,
-            'attributes': attributes
+        fire_device_event(self._hass, EVENT_DEVICE_DATA_CHANGED, device_id, {
+            'deviceId': device_id,
+            'changed': changed
         })
 
-    @staticmethod
-    async def _send_command(ws, agClientId, deviceId: str, attributes: dict):
+    async def async_send_command(self, device_id: str, attributes: dict):
         """
-        通过websocket发送控制命令
-        :param ws:
-        :param agClientId:
-        :param deviceId: 设备ID
-        :param attributes: 获取设备attributes (如: { "targetTemp": "42" })
+        下发控制命令，开启等待确认时会在网关确认后才返回
+        :param device_id:
+        :param attributes:
         :return:
         """
+        waiter = self._add_command(device_id, attributes)
+        if self._wait_command_ack:
+            await waiter
+
+    @callback
+    def _add_command(self, device_id: str, attributes: dict) -> asyncio.Future:
+        connection = self._device_connections.get(device_id)
+        if connection is None or connection.batcher is None:
+            raise ConnectionError('device gateway is not connected')
+
+        return connection.batcher.add(device_id, attributes)
+
+    async def send_commands(
+            self,
+            writer: WebSocketWriter,
+            agClientId,
+            commands: List[Tuple[str, dict]],
+            priority: int = PRIORITY_COMMAND
+    ) -> asyncio.Future:
+        """
+        通过一个BatchCmdReq发送多条控制命令
+        :param writer:
+        :param agClientId:
+        :param commands: (设备ID, attributes) 列表
+        :param priority: 刷新请求在发送队列积压时会被丢弃
+        :return: 网关确认时完成的future
+        """
         sn = random_str(32)
-        await ws.send_str(json.dumps({
-            'agClientId': agClientId,
-            "topic": "BatchCmdReq",
-            'content': {
-                'trace': random_str(32),
-                'sn': sn,
-                'data': [
-                    {
-                        'sn': sn,
-                        'index': 0,
-                        'delaySeconds': 0,
-                        'subSn': sn + ':0',
-                        'deviceId': deviceId,
-                        'cmdArgs': attributes
-                    }
-                ]
-            }
-        }))
+        device_ids = [device_id for device_id, _ in commands]
+        tracker = self._refresh_tracker if priority >= PRIORITY_REFRESH else self._tracker
+        ack = tracker.track(sn, device_ids, {
+            device_id: self._devices[device_id].product_name for device_id in device_ids if device_id in self._devices
+        })
+
+        try:
+            sent = await writer.send({
+                'agClientId': agClientId,
+                "topic": "BatchCmdReq",
+                'content': {
+                    'trace': random_str(32),
+                    'sn': sn,
+                    'data': [
+                        {
+                            'sn': sn,
+                            'index': index,
+                            'delaySeconds': 0,
+                            'subSn': '{}:{}'.format(sn, index),
+                            'deviceId': device_id,
+                            'cmdArgs': attributes
+                        } for index, (device_id, attributes) in enumerate(commands)
+                    ]
+                }
+            }, priority)
+        except Exception:
+            tracker.discard(sn)
+            raise
+
+        if not sent:
+            tracker.discard(sn)
+
+        return ack
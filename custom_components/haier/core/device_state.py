@@ -0,0 +1,170 @@
+import sys
+import time
+from collections import ChainMap
+from types import MappingProxyType
+from typing import Any, Iterable, List, Mapping, Optional, Set, Tuple
+
+from ..helpers import values_equal
+
+
+class DeviceState:
+    """
+    设备当前状态，每个设备仅保存一份，实体通过只读视图读取
+    """
+
+    __slots__ = ('_values', '_view', '_pending', '_pending_owners', '_optimistic_view', '_updated_at', '_synced', '_online')
+
+    def __init__(self):
+        self._values = {}
+        self._view = MappingProxyType(self._values)
+        # 已下发但设备尚未确认的值
+        self._pending = {}
+        # key -> 写入该值的那一次写入，避免较早写入的超时放弃较新的写入
+        self._pending_owners = {}
+        self._optimistic_view = ChainMap(MappingProxyType(self._pending), self._view)
+        self._updated_at: Optional[float] = None
+        self._synced = False
+        # 在线状态，未知时为None
+        self._online: Optional[bool] = None
+
+    @property
+    def values(self) -> Mapping[str, Any]:
+        """
+        attributes数据的只读视图
+        :return:
+        """
+        return self._view
+
+    @property
+    def optimistic_values(self) -> Mapping[str, Any]:
+        """
+        叠加了未确认写入值的只读视图
+        :return:
+        """
+        return self._optimistic_view
+
+    @property
+    def updated_at(self) -> Optional[float]:
+        """
+        最后一次收到数据的时间（time.time()），从未收到数据时为None
+        :return:
+        """
+        return self._updated_at
+
+    @property
+    def synced(self) -> bool:
+        return self._synced
+
+    @property
+    def online(self) -> Optional[bool]:
+        return self._online
+
+    def set_online(self, online: bool) -> bool:
+        """
+        更新在线状态
+        :param online:
+        :return: 是否由离线（或未知）变为在线
+        """
+        came_online = online and self._online is not True
+        self._online = online
+
+        return came_online
+
+    def update(self, values: Iterable[Tuple[str, Any]]) -> Set[str]:
+        """
+        写入最新数据
+        :param values: (key, value) 序列
+        :return: 值发生变化的key，未同步状态下返回所有key
+        """
+        changed = set()
+        for key, value in values:
+            if isinstance(value, str):
+                # 同类设备的取值大量重复，驻留后可共享同一个字符串对象
+                value = sys.intern(value)
+
+            if key not in self._values or self._values[key] != value:
+                self._values[sys.intern(key)] = value
+                changed.add(key)
+
+            # 设备上报的值与未确认的写入值一致，写入已生效
+            if key in self._pending and values_equal(self._pending[key], value):
+                del self._pending[key]
+                del self._pending_owners[key]
+
+        if not self._synced:
+            changed = set(self._values.keys())
+            self._synced = True
+
+        self._updated_at = time.time()
+
+        return changed
+
+    def touch(self):
+        """
+        收到数据但没有任何变化（如内容重复的消息），只更新最后收到数据的时间
+        :return:
+        """
+        self._updated_at = time.time()
+
+    def matches(self, values: dict) -> bool:
+        """
+        写入的值是否与设备已确认的值全部一致（存在未确认写入的key视为不一致）
+        :param values:
+        :return:
+        """
+        if not self._synced:
+            return False
+
+        for key, value in values.items():
+            if key in self._pending or key not in self._values:
+                return False
+
+            if not values_equal(self._values[key], value):
+                return False
+
+        return True
+
+    def set_pending(self, values: dict) -> object:
+        """
+        记录已下发但尚未确认的值
+        :param values:
+        :return: 本次写入的标识，用于 expire_pending
+        """
+        owner = object()
+        for key, value in values.items():
+            self._pending[key] = value
+            self._pending_owners[key] = owner
+
+        return owner
+
+    def expire_pending(self, owner: object) -> List[str]:
+        """
+        放弃仍未确认的写入值（仅限由该次写入设置且未被覆盖的值）
+        :param owner: set_pending 的返回值
+        :return: 被放弃的key
+        """
+        expired = [key for key, item in self._pending_owners.items() if item is owner]
+        for key in expired:
+            del self._pending[key]
+            del self._pending_owners[key]
+
+        return expired
+
+    def resume(self) -> Set[str]:
+        """
+        沿用已有数据恢复为同步状态（如短暂断线后重连）
+        :return: 恢复前为未同步状态时返回所有key，否则返回空集合
+        """
+        if self._synced or self._updated_at is None:
+            return set()
+
+        self._synced = True
+
+        return set(self._values.keys())
+
+    def mark_unsynced(self):
+        """
+        标记为未同步（如网关断线），下一次更新时将视为全部key发生变化
+        :return:
+        """
+        self._synced = False
@@ -1,6 +1,7 @@
 from typing import Callable, Coroutine, Any
 
 from homeassistant.core import HomeAssistant, CALLBACK_TYPE, Event
+from homeassistant.helpers.dispatcher import async_dispatcher_connect, async_dispatcher_send
 
 from custom_components.haier import DOMAIN
 
@@ -14,6 +15,10 @@ def wrap_event(name: str) -> str:
     return '{}_{}'.format(DOMAIN, name)
 
 
+def wrap_device_event(name: str, device_id: str) -> str:
+    return '{}_{}'.format(wrap_event(name), device_id)
+
+
 def fire_event(hass: HomeAssistant, event: str, data: dict) -> None:
     hass.bus.fire(wrap_event(event), data)
 
@@ -24,3 +29,32 @@ def listen_event(
         callback: Callable[[Event], Coroutine[Any, Any, None] | None]
 ) -> CALLBACK_TYPE:
     return hass.bus.async_listen(wrap_event(event), callback)
+
+
+def fire_device_event(hass: HomeAssistant, event: str, device_id: str, data: dict) -> None:
+    """
+    按设备分发事件，只有订阅了该设备的监听器才会被调用
+    :param hass:
+    :param event:
+    :param device_id:
+    :param data:
+    :return:
+    """
+    async_dispatcher_send(hass, wrap_device_event(event, device_id), data)
+
+
+def listen_device_event(
+        hass: HomeAssistant,
+        event: str,
+        device_id: str,
+        callback: Callable[[dict], Coroutine[Any, Any, None] | None]
+) -> CALLBACK_TYPE:
+    """
+    订阅指定设备的事件
+    :param hass:
+    :param event:
+    :param device_id:
+    :param callback: 回调参数为事件数据
+    :return:
+    """
+    return async_dispatcher_connect(hass, wrap_device_event(event, device_id), callback)
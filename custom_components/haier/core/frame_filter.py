@@ -0,0 +1,79 @@
+from collections import deque
+from typing import Dict, Iterable
+
+# 每个设备保留的最近消息sn数
+RECENT_SN_SIZE = 16
+
+SUPPRESSED_DUPLICATE_SN = 'duplicate_sn'
+SUPPRESSED_DUPLICATE_CONTENT = 'duplicate_content'
+SUPPRESSED_STALE_SNAPSHOT = 'stale_snapshot'
+
+
+class FrameFilter:
+    """
+    过滤重复投递的GenMsgDown消息：sn在最近收到的消息中出现过，或内容与该设备上一条消息完全相同
+    """
+
+    def __init__(self, size: int = RECENT_SN_SIZE):
+        self._size = size
+        # 设备ID -> (最近的sn队列, 对应的set)
+        self._recent_sn: Dict[str, tuple] = {}
+        # 设备ID -> 上一条消息的内容hash
+        self._last_hash: Dict[str, int] = {}
+        self._suppressed = {
+            SUPPRESSED_DUPLICATE_SN: 0,
+            SUPPRESSED_DUPLICATE_CONTENT: 0,
+            SUPPRESSED_STALE_SNAPSHOT: 0,
+        }
+
+    def check(self, device_id: str, sn: str | None, content: str) -> str | None:
+        """
+        判断消息是否重复，不重复时记录该消息
+        :param device_id:
+        :param sn:
+        :param content: 未解码的消息内容
+        :return: 重复时返回原因（SUPPRESSED_DUPLICATE_SN/SUPPRESSED_DUPLICATE_CONTENT），否则返回None
+        """
+        if sn:
+            queue, seen = self._recent_sn.setdefault(device_id, (deque(), set()))
+            if sn in seen:
+                self._suppressed[SUPPRESSED_DUPLICATE_SN] += 1
+                return SUPPRESSED_DUPLICATE_SN
+
+            queue.append(sn)
+            seen.add(sn)
+            if len(queue) > self._size:
+                seen.discard(queue.popleft())
+
+        # 只与上一条比较，状态变化后又变回原值（A -> B -> A）的消息不能丢弃
+        content_hash = hash(content)
+        if self._last_hash.get(device_id) == content_hash:
+            self._suppressed[SUPPRESSED_DUPLICATE_CONTENT] += 1
+            return SUPPRESSED_DUPLICATE_CONTENT
+
+        self._last_hash[device_id] = content_hash
+
+        return None
+
+    def record_stale_snapshot(self):
+        self._suppressed[SUPPRESSED_STALE_SNAPSHOT] += 1
+
+    def reset(self, device_id: str):
+        """
+        设备数据被其他来源（如REST快照）更新后，下一条消息即使内容与上一条相同也需要处理
+        :param device_id:
+        :return:
+        """
+        self._last_hash.pop(device_id, None)
+
+    def clear(self, device_ids: Iterable[str]):
+        """
+        断线后设备需要重新同步，清空内容记录
+        :param device_ids:
+        :return:
+        """
+        for device_id in device_ids:
+            self._last_hash.pop(device_id, None)
+
+    def stats(self) -> dict:
+        return dict(self._suppressed)
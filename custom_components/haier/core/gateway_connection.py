@@ -0,0 +1,482 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from datetime import timedelta
+from typing import TYPE_CHECKING, Callable, List
+
+import aiohttp
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_track_time_interval
+
+from ..const import INIT_MODE_WEBSOCKET
+from .client import HaierClient
+from .command_batcher import CommandBatcher, COMMAND_BATCH_MAX_SIZE, GET_ALL_PROPERTY_COMMAND
+from .device import HaierDevice
+from .event import EVENT_DEVICE_DATA_CHANGED, fire_device_event
+from .refresh_scheduler import RefreshScheduler
+from .retry import RetryPolicy
+from .ws_writer import WebSocketWriter, PRIORITY_COMMAND, PRIORITY_HEARTBEAT, PRIORITY_REFRESH
+
+if TYPE_CHECKING:
+    from .device_gateway import HaierDeviceGateway
+
+_LOGGER = logging.getLogger(__name__)
+
+# 重连退避策略：首次约1秒内重连，连续失败时指数增长，最长60秒
+RECONNECT_POLICY = RetryPolicy(base_delay=1, max_delay=60)
+# 连接保持超过该时长（秒）后视为稳定，重置重连退避
+STABLE_CONNECTION_SECONDS = 60
+# 保留的连接记录数
+RECONNECT_HISTORY_SIZE = 20
+# 断线时长（秒）不超过该值时，重连后先沿用断线前的设备数据，再以低优先级请求一次全量数据，
+# 断线期间的状态变化（如按下设备上的按键）会在响应到达后更新，而不必等REST快照
+RESYNC_GRACE_SECONDS = 30
+# 连接空闲多久（秒）后发送心跳，心跳正常响应时逐步拉长到最大值，重连后恢复为最小值
+HEARTBEAT_MIN_INTERVAL = 10
+HEARTBEAT_MAX_INTERVAL = 60
+# 心跳发出后多久（秒）仍未收到任何消息视为连接已失效
+HEARTBEAT_TIMEOUT = 10
+# 检查连接状态的间隔（秒）
+HEARTBEAT_CHECK_INTERVAL = 2
+# 通过websocket初始化时每批请求的设备数及批次间隔（秒）
+WS_INIT_BATCH_SIZE = 10
+WS_INIT_BATCH_INTERVAL = 0.5
+# 通过websocket初始化时等待设备响应的时长（秒），超时的设备改用REST接口获取
+WS_INIT_DEADLINE = 15
+
+
+def random_str(length: int = 32) -> str:
+    return ''.join(random.choice('abcdef1234567890') for _ in range(length))
+
+
+class GatewayConnection:
+    """
+    与设备网关之间的一条websocket连接：负责一组设备的订阅、心跳及重连，收到的消息交由网关统一分发
+    """
+
+    def __init__(
+            self,
+            hass: HomeAssistant,
+            gateway: 'HaierDeviceGateway',
+            client: HaierClient,
+            index: int,
+            devices: List[HaierDevice]
+    ):
+        self._hass = hass
+        self._gateway = gateway
+        self._client = client
+        self._index = index
+        self._devices = devices
+        self._session = async_get_clientsession(hass)
+        self._batcher: CommandBatcher | None = None
+        self._writer: WebSocketWriter | None = None
+        self._agClientId: str | None = None
+        self._scheduler: RefreshScheduler | None = None
+        self._ws = None
+        self._server: str | None = None
+        self._connected_at: float | None = None
+        self._reconnect_history = deque(maxlen=RECONNECT_HISTORY_SIZE)
+        self._disconnected_at: float | None = None
+        # 为True时表示当前连接因token轮换而主动断开，重连时设备状态保持不变
+        self._token_rotating = False
+        # 连接存活检测
+        self._last_received_at = 0.0
+        self._heartbeat_sn: str | None = None
+        self._heartbeat_sent_at = 0.0
+        self._heartbeat_interval = HEARTBEAT_MIN_INTERVAL
+        self._liveness_expired = False
+
+    @property
+    def devices(self) -> List[HaierDevice]:
+        return self._devices
+
+    @property
+    def batcher(self) -> CommandBatcher | None:
+        """
+        当前连接的命令合并器，未连接时为None
+        :return:
+        """
+        return self._batcher
+
+    def stats(self) -> dict:
+        return {
+            'index': self._index,
+            'devices': len(self._devices),
+            'connected': self._ws is not None,
+            'heartbeat_interval': self._heartbeat_interval,
+            'send_queue': self._writer.stats() if self._writer else None,
+            'reconnect_history': list(self._reconnect_history),
+        }
+
+    async def async_add_devices(self, devices: List[HaierDevice]):
+        """
+        将新设备加入当前连接，已连接时只订阅新增的设备并拉取其数据
+        :param devices:
+        :return:
+        """
+        self._devices.extend(devices)
+
+        writer = self._writer
+        if writer is None:
+            # 未连接时下次连接会订阅所有设备
+            return
+
+        if self._scheduler is not None:
+            for device in devices:
+                self._scheduler.add_device(device)
+
+        await writer.send({
+            'agClientId': self._agClientId,
+            'topic': 'BoundDevs',
+            'content': {
+                'devs': [device.id for device in devices]
+            }
+        }, PRIORITY_COMMAND)
+        self._gateway.request_resync([device.id for device in devices])
+
+    @callback
+    def remove_devices(self, device_ids: List[str]):
+        self._devices[:] = [device for device in self._devices if device.id not in device_ids]
+        if self._scheduler is not None:
+            for device_id in device_ids:
+                self._scheduler.remove_device(device_id)
+
+    async def rotate_token(self):
+        """
+        token已更新，主动断开当前连接并使用新token重连，期间实体保持可用且不会重新拉取数据
+        :return:
+        """
+        if self._ws is None or self._ws.closed:
+            return
+
+        self._token_rotating = True
+        await self._ws.close()
+
+    @callback
+    def is_heartbeat_reply(self, sn: str | None) -> bool:
+        """
+        判断收到的消息是否为当前连接心跳的响应
+        :param sn:
+        :return:
+        """
+        if self._heartbeat_sn is None or sn != self._heartbeat_sn:
+            return False
+
+        self._on_heartbeat_answered()
+
+        return True
+
+    async def run(self):
+        failures = 0
+        while True:
+            attempt = {
+                'started_at': time.time(),
+                'connect_duration': None,
+                'connected_duration': None,
+                'error': None
+            }
+            self._reconnect_history.append(attempt)
+            started_at = time.monotonic()
+            self._connected_at = None
+
+            try:
+                await self._connect()
+            except asyncio.CancelledError:
+                _LOGGER.debug("device gateway #%s stopped", self._index)
+                return
+            except Exception as e:
+                attempt['error'] = repr(e)
+                _LOGGER.exception("device gateway #%s disconnected. Waiting to retry.", self._index)
+
+            if self._connected_at is not None:
+                attempt['connect_duration'] = round(self._connected_at - started_at, 3)
+                attempt['connected_duration'] = round(time.monotonic() - self._connected_at, 3)
+
+            # token轮换导致的断开立即重连
+            if self._token_rotating:
+                continue
+
+            # 连接保持足够长时间视为恢复正常，重置退避
+            if attempt['connected_duration'] is not None and attempt['connected_duration'] >= STABLE_CONNECTION_SECONDS:
+                failures = 0
+
+            failures += 1
+            delay = RECONNECT_POLICY.compute_delay(failures)
+            _LOGGER.debug('device gateway #%s reconnecting in %.2fs (attempt %s)', self._index, delay, failures)
+            await asyncio.sleep(delay)
+
+    async def _connect(self):
+        resume = self._token_rotating
+        self._token_rotating = False
+
+        # 优先使用上次分配的网关地址，连接失败时再重新分配
+        server = self._server
+        if server is None:
+            server = await self._client.get_device_gateway()
+        _LOGGER.debug('device gateway #{}: {}'.format(self._index, server))
+
+        token = self._gateway.token
+        # 同一账号的多条连接需使用不同的agClientId，第一条连接保持原有的取值
+        agClientId = token if self._index == 0 else '{}-{}'.format(token, self._index)
+        cancels = []
+        try:
+            url = '{}/userag?token={}&agClientId={}'.format(server, token, agClientId)
+            try:
+                ws = await self._session.ws_connect(url)
+            except Exception:
+                self._server = None
+                raise
+
+            async with ws:
+                _LOGGER.debug('device gateway #%s connected', self._index)
+                self._ws = ws
+                self._server = server
+                self._connected_at = time.monotonic()
+
+                # 所有消息都通过writer按优先级发送
+                writer = WebSocketWriter(self._hass, ws)
+                writer.start()
+                self._writer = writer
+                self._agClientId = agClientId
+                cancels.append(writer.close)
+
+                # 订阅设备状态
+                await writer.send({
+                    'agClientId': agClientId,
+                    'topic': 'BoundDevs',
+                    'content': {
+                        'devs': [device.id for device in self._devices]
+                    }
+                })
+
+                # 定期发送心跳包
+                cancels.append(self._start_heartbeat_sender(ws, writer, agClientId))
+
+                # 对于部分设备需要定时发送刷新命令以保持数据更新
+                cancels.append(self._start_refresh_scheduler(writer, agClientId))
+
+                # 短时间内的多条控制命令合并下发
+                batcher = CommandBatcher(
+                    self._hass,
+                    lambda commands: self._gateway.send_commands(writer, agClientId, commands)
+                )
+                self._batcher = batcher
+                cancels.append(batcher.cancel)
+
+                # 网关只会在设备数据有变更的时候才会下发数据，所以刚连上网关时需要手动拉取一下数据
+                # token轮换导致的重连间隔很短，设备数据仍然有效，无需重新拉取
+                if not resume:
+                    cancels.append(await self._init_devices(writer, agClientId))
+
+                async for msg in ws:
+                    self._last_received_at = time.monotonic()
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        await self._gateway.dispatch_message(self, msg.data)
+                    elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING):
+                        raise RuntimeError("WebSocket 连接已关闭")
+                    elif msg.type == aiohttp.WSMsgType.ERROR:
+                        raise RuntimeError(f"WebSocket 连接发生异常: {ws.exception()}")
+                    else:
+                        _LOGGER.warning("收到未知类型的消息: {}".format(msg.type))
+
+                if self._liveness_expired:
+                    raise RuntimeError('心跳超时，连接已失效')
+        finally:
+            self._ws = None
+            self._batcher = None
+            self._writer = None
+            self._scheduler = None
+            if not self._token_rotating and self._connected_at is not None:
+                self._disconnected_at = time.time()
+            self._gateway.connection_closed(self._devices, self._token_rotating)
+            for cancel in cancels:
+                cancel()
+
+    def _start_heartbeat_sender(self, ws, writer: WebSocketWriter, agClientId: str):
+        """
+        连接空闲时发送心跳并检查连接是否存活：心跳发出后超时未收到任何消息则主动断开重连
+        :param ws:
+        :param writer:
+        :param agClientId:
+        :return:
+        """
+        self._last_received_at = time.monotonic()
+        self._heartbeat_sn = None
+        self._heartbeat_interval = HEARTBEAT_MIN_INTERVAL
+        self._liveness_expired = False
+
+        async def send_heartbeat():
+            try:
+                # 队列中尚未发出的心跳直接用新的心跳替换
+                await writer.send({
+                    'agClientId': agClientId,
+                    'topic': 'HeartBeat',
+                    'content': {
+                        'sn': self._heartbeat_sn,
+                        'duration': 0
+                    }
+                }, PRIORITY_HEARTBEAT, merge_key='heartbeat')
+
+                _LOGGER.debug('Sending heartbeat')
+            except Exception:
+                _LOGGER.exception('Failed to send heartbeat')
+
+        @callback
+        def check(now):
+            current = time.monotonic()
+
+            if self._heartbeat_sn is not None:
+                # 心跳发出后收到过任何消息都说明连接正常，但只有心跳响应才会拉长心跳间隔
+                if self._last_received_at >= self._heartbeat_sent_at:
+                    self._heartbeat_sn = None
+                elif current - self._heartbeat_sent_at >= HEARTBEAT_TIMEOUT:
+                    _LOGGER.warning(
+                        'No message received in %.0fs after heartbeat, reconnecting device gateway #%s',
+                        current - self._heartbeat_sent_at, self._index
+                    )
+                    self._liveness_expired = True
+                    self._heartbeat_sn = None
+                    self._hass.async_create_task(ws.close())
+                return
+
+            # 连接空闲超过心跳间隔才发送心跳，有数据往来时无需发送
+            if current - self._last_received_at >= self._heartbeat_interval:
+                self._heartbeat_sn = random_str(32)
+                self._heartbeat_sent_at = current
+                self._hass.async_create_task(send_heartbeat())
+
+        return async_track_time_interval(self._hass, check, timedelta(seconds=HEARTBEAT_CHECK_INTERVAL))
+
+    @callback
+    def _on_heartbeat_answered(self):
+        """
+        心跳得到响应：连接稳定时逐步拉长心跳间隔
+        :return:
+        """
+        self._heartbeat_sn = None
+        self._heartbeat_interval = min(HEARTBEAT_MAX_INTERVAL, self._heartbeat_interval * 2)
+
+    def _start_refresh_scheduler(self, writer: WebSocketWriter, agClientId: str):
+        async def send(device_ids: List[str]):
+            for i in range(0, len(device_ids), COMMAND_BATCH_MAX_SIZE):
+                await self._gateway.send_commands(writer, agClientId, [
+                    (device_id, {GET_ALL_PROPERTY_COMMAND: GET_ALL_PROPERTY_COMMAND})
+                    for device_id in device_ids[i:i + COMMAND_BATCH_MAX_SIZE]
+                ], PRIORITY_REFRESH)
+
+        self._scheduler = RefreshScheduler(self._hass, self._devices, self._gateway.refresh_intervals, send)
+
+        return self._scheduler.start()
+
+    async def _init_devices(self, writer: WebSocketWriter, agClientId: str) -> Callable[[], None]:
+        """
+        连接建立后同步设备数据：断线时间较短时沿用已有数据并在后台重新确认，否则重新获取设备数据
+        :param writer:
+        :param agClientId:
+        :return: 用于取消后台同步任务
+        """
+        outage = None if self._disconnected_at is None else time.time() - self._disconnected_at
+
+        stale_devices = []
+        resumed_ids = []
+        for device in self._devices:
+            if device.state.updated_at is None or outage is None or outage > RESYNC_GRACE_SECONDS:
+                stale_devices.append(device)
+                continue
+
+            # 离线设备保持不可用，上线后会单独拉取数据
+            if device.state.online is False:
+                continue
+
+            # 断线期间数据大概率没有变化，先沿用已有数据恢复实体状态
+            changed = device.state.resume()
+            if changed:
+                fire_device_event(self._hass, EVENT_DEVICE_DATA_CHANGED, device.id, {
+                    'deviceId': device.id,
+                    'changed': changed
+                })
+            resumed_ids.append(device.id)
+
+        cancels = []
+        if resumed_ids:
+            # 沿用的数据可能已过期，排在控制命令之后再确认一次
+            task = self._hass.async_create_background_task(
+                self._request_all_properties(writer, agClientId, resumed_ids),
+                'haier-refresh-resumed-devices-{}'.format(self._index)
+            )
+            cancels.append(task.cancel)
+
+        def cancel():
+            for item in cancels:
+                item()
+
+        if not stale_devices:
+            return cancel
+
+        try:
+            device_online_statues = await self._client.get_devices_online_status()
+        except Exception:
+            _LOGGER.exception('Failed to get devices online status')
+            device_online_statues = {}
+
+        for device in stale_devices:
+            if device.id in device_online_statues:
+                device.state.set_online(device_online_statues[device.id])
+
+        # 跳过已离线的设备，设备上线后会单独拉取数据
+        device_ids = [device.id for device in stale_devices if device.state.online is not False]
+
+        if self._gateway.init_mode != INIT_MODE_WEBSOCKET:
+            self._gateway.request_resync(device_ids)
+            return cancel
+
+        task = self._hass.async_create_background_task(
+            self._init_devices_over_websocket(writer, agClientId, device_ids),
+            'haier-init-devices-{}'.format(self._index)
+        )
+        cancels.append(task.cancel)
+
+        return cancel
+
+    async def _init_devices_over_websocket(self, writer: WebSocketWriter, agClientId: str, device_ids: List[str]):
+        """
+        通过websocket分批请求设备全量数据，超时未响应的设备再通过REST接口获取
+        :param writer:
+        :param agClientId:
+        :param device_ids:
+        :return:
+        """
+        requested_at = time.time()
+        await self._request_all_properties(writer, agClientId, device_ids)
+
+        await asyncio.sleep(WS_INIT_DEADLINE)
+
+        missed = [
+            device_id for device_id in device_ids if not self._gateway.is_updated_since(device_id, requested_at)
+        ]
+        if missed:
+            _LOGGER.debug('Devices not answered over websocket, fallback to REST: %s', missed)
+            self._gateway.request_resync(missed)
+
+    async def _request_all_properties(self, writer: WebSocketWriter, agClientId: str, device_ids: List[str]):
+        """
+        以低优先级分批请求设备全量数据，响应通过GenMsgDown上报
+        :param writer:
+        :param agClientId:
+        :param device_ids:
+        :return:
+        """
+        for i in range(0, len(device_ids), WS_INIT_BATCH_SIZE):
+            if i > 0:
+                await asyncio.sleep(WS_INIT_BATCH_INTERVAL)
+
+            batch = device_ids[i:i + WS_INIT_BATCH_SIZE]
+            try:
+                await self._gateway.send_commands(writer, agClientId, [
+                    (device_id, {GET_ALL_PROPERTY_COMMAND: GET_ALL_PROPERTY_COMMAND}) for device_id in batch
+                ], PRIORITY_REFRESH)
+            except Exception:
+                _LOGGER.exception('Failed to request all properties of devices: %s', batch)
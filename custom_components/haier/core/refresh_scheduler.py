@@ -0,0 +1,130 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List
+
+from homeassistant.core import HomeAssistant, callback, CALLBACK_TYPE
+from homeassistant.helpers.event import async_track_time_interval
+
+from .device import HaierDevice
+
+_LOGGER = logging.getLogger(__name__)
+
+# 检查到期设备的间隔（秒）
+REFRESH_TICK_INTERVAL = 1
+
+
+class RefreshScheduler:
+    """
+    按产品配置的间隔向设备发送刷新命令：
+    同一间隔的设备均匀分布在整个间隔内，间隔内已上报过数据的设备顺延到下一次
+    """
+
+    def __init__(
+            self,
+            hass: HomeAssistant,
+            devices: List[HaierDevice],
+            intervals: Dict[str, int],
+            send: Callable[[List[str]], Awaitable]
+    ):
+        """
+        :param hass:
+        :param devices:
+        :param intervals: 产品名称 -> 刷新间隔（秒）
+        :param send: 向一批设备发送刷新命令
+        """
+        self._hass = hass
+        self._send = send
+        self._intervals = intervals
+        # 设备ID -> (设备, 刷新间隔)
+        self._devices: Dict[str, tuple] = {
+            device.id: (device, intervals[device.product_name])
+            for device in devices if intervals.get(device.product_name, 0) > 0
+        }
+        # 设备ID -> 下一次刷新时间（time.time()）
+        self._due: Dict[str, float] = {}
+        self._sending = False
+        self._cancel: CALLBACK_TYPE | None = None
+
+    def start(self) -> CALLBACK_TYPE:
+        if not self._devices:
+            return self.stop
+
+        now = time.time()
+
+        # 按间隔分组后错开每个设备的首次刷新时间，避免同一时刻集中发送
+        groups: Dict[int, List[str]] = {}
+        for device_id, (_, interval) in self._devices.items():
+            groups.setdefault(interval, []).append(device_id)
+
+        for interval, device_ids in groups.items():
+            for index, device_id in enumerate(device_ids):
+                self._due[device_id] = now + interval * (index + 1) / len(device_ids)
+
+        self._cancel = async_track_time_interval(self._hass, self._tick, timedelta(seconds=REFRESH_TICK_INTERVAL))
+
+        return self.stop
+
+    @callback
+    def add_device(self, device: HaierDevice):
+        interval = self._intervals.get(device.product_name, 0)
+        if interval <= 0:
+            return
+
+        self._devices[device.id] = (device, interval)
+        self._due[device.id] = time.time() + interval
+        if self._cancel is None:
+            self._cancel = async_track_time_interval(
+                self._hass, self._tick, timedelta(seconds=REFRESH_TICK_INTERVAL)
+            )
+
+    @callback
+    def remove_device(self, device_id: str):
+        self._devices.pop(device_id, None)
+        self._due.pop(device_id, None)
+
+    @callback
+    def stop(self):
+        if self._cancel:
+            self._cancel()
+            self._cancel = None
+
+    @callback
+    def _tick(self, now=None):
+        # 上一批仍在发送队列中时等待下一次检查
+        if self._sending:
+            return
+
+        current = time.time()
+        device_ids = []
+        for device_id, due in self._due.items():
+            if due > current:
+                continue
+
+            device, interval = self._devices[device_id]
+            # 离线设备不会响应刷新命令
+            if device.state.online is False:
+                self._due[device_id] = current + interval
+                continue
+
+            updated_at = device.state.updated_at
+            if updated_at is not None and current - updated_at < interval:
+                # 最近已上报过数据，从上报时间开始重新计时
+                self._due[device_id] = updated_at + interval
+                continue
+
+            self._due[device_id] = due + interval if due + interval > current else current + interval
+            device_ids.append(device_id)
+
+        if device_ids:
+            self._sending = True
+            self._hass.async_create_task(self._async_send(device_ids))
+
+    async def _async_send(self, device_ids: List[str]):
+        try:
+            await self._send(device_ids)
+            _LOGGER.debug('Sent force refresh command to devices: %s', device_ids)
+        except Exception:
+            _LOGGER.exception('Failed to send force refresh to devices: %s', device_ids)
+        finally:
+            self._sending = False
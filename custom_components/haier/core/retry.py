@@ -0,0 +1,125 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+
+class RetryPolicy:
+    """
+    重试策略：指数退避 + full jitter
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 30.0):
+        """
+        :param max_retries: 最大重试次数（不包含首次请求）
+        :param base_delay: 首次重试的最大等待时间（秒）
+        :param max_delay: 单次等待时间上限（秒）
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def compute_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        计算第attempt次重试前需要等待的时间
+        :param attempt: 重试次数，从1开始
+        :param retry_after: 服务端要求的等待时间，存在时优先使用
+        :return:
+        """
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后进入open状态，在恢复时间内直接拒绝请求，
+    之后进入half_open状态放行请求，成功则恢复，失败则重新熔断
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 60.0):
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return CIRCUIT_CLOSED
+
+        if time.monotonic() - self._opened_at < self._recovery_timeout:
+            return CIRCUIT_OPEN
+
+        return CIRCUIT_HALF_OPEN
+
+    @property
+    def failures(self) -> int:
+        return self._failures
+
+    @property
+    def retry_in(self) -> float:
+        """
+        距离熔断结束的剩余时间（秒）
+        :return:
+        """
+        if self._opened_at is None:
+            return 0.0
+
+        return max(0.0, self._recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == CIRCUIT_HALF_OPEN:
+            # 只放行一个试探请求，其余请求在试探结果出来前继续快速失败
+            self._opened_at = time.monotonic()
+            return True
+
+        return state == CIRCUIT_CLOSED
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or self._failures >= self._failure_threshold:
+            self._opened_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self._name,
+            'state': self.state,
+            'failures': self._failures,
+            'retry_in': round(self.retry_in, 1)
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析Retry-After响应头，支持秒数和HTTP日期两种格式
+    :param value:
+    :return:
+    """
+    if not value:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
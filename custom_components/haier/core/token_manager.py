@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant, CALLBACK_TYPE
+from homeassistant.helpers.event import async_call_later
+
+from .client import HaierClient
+from .config import AccountConfig
+
+_LOGGER = logging.getLogger(__name__)
+
+# 在token过期前多久进行刷新（秒），剩余有效期不足两倍该值时改为在剩余有效期过半时刷新
+TOKEN_REFRESH_MARGIN = 86400
+# 两次定时刷新之间的最小间隔（秒），避免有效期过短时连续刷新
+TOKEN_REFRESH_MIN_DELAY = 60
+# 刷新失败后的重试间隔（秒）
+TOKEN_REFRESH_RETRY_DELAY = 300
+# 两次被动刷新（接口返回token失效）之间的最小间隔（秒）
+TOKEN_REACTIVE_REFRESH_MIN_INTERVAL = 60
+
+
+class HaierTokenManager:
+    """
+    token管理器：按expires_at定时刷新token，并在接口返回token失效时立即刷新
+    """
+
+    def __init__(
+            self,
+            hass: HomeAssistant,
+            entry: ConfigEntry,
+            client: HaierClient,
+            on_token_updated: Callable[[str], Awaitable[None]]
+    ):
+        self._hass = hass
+        self._entry = entry
+        self._client = client
+        self._on_token_updated = on_token_updated
+        self._lock = asyncio.Lock()
+        self._cancel_scheduled: CALLBACK_TYPE | None = None
+        self._last_refreshed_at = float('-inf')
+
+    def start(self):
+        self._client.set_auth_error_handler(self.async_handle_auth_error)
+        self._schedule(self._get_refresh_delay())
+
+    def stop(self):
+        self._client.set_auth_error_handler(None)
+        if self._cancel_scheduled:
+            self._cancel_scheduled()
+            self._cancel_scheduled = None
+
+    async def async_refresh(self) -> bool:
+        """
+        刷新token，并发调用只会刷新一次
+        :return: 是否刷新成功
+        """
+        started_at = time.monotonic()
+        async with self._lock:
+            # 等待锁期间已由其他调用方完成刷新
+            if self._last_refreshed_at > started_at:
+                return True
+
+            cfg = AccountConfig(self._hass, self._entry)
+            try:
+                token_info = await self._client.refresh_token(cfg.refresh_token)
+            except Exception:
+                _LOGGER.exception('token refresh failed')
+                self._schedule(TOKEN_REFRESH_RETRY_DELAY)
+                return False
+
+            cfg.token = token_info.token
+            cfg.refresh_token = token_info.refresh_token
+            cfg.expires_at = int(time.time()) + token_info.expires_in
+            cfg.save()
+
+            self._last_refreshed_at = time.monotonic()
+            _LOGGER.info('token refreshed, expires at {}'.format(cfg.expires_at))
+
+            await self._on_token_updated(cfg.token)
+            self._schedule(self._get_refresh_delay())
+
+            return True
+
+    async def async_handle_auth_error(self) -> bool:
+        """
+        接口返回token失效时调用
+        :return: 是否刷新成功
+        """
+        # 刚刷新过token，失败的请求大概率使用的是旧token，直接重试即可
+        if time.monotonic() - self._last_refreshed_at < TOKEN_REACTIVE_REFRESH_MIN_INTERVAL:
+            return True
+
+        _LOGGER.warning('token is invalid, refreshing...')
+
+        return await self.async_refresh()
+
+    def _get_refresh_delay(self) -> float:
+        cfg = AccountConfig(self._hass, self._entry)
+        remaining = cfg.expires_at - time.time()
+        margin = min(TOKEN_REFRESH_MARGIN, remaining / 2)
+
+        return max(TOKEN_REFRESH_MIN_DELAY, remaining - margin)
+
+    def _schedule(self, delay: float):
+        if self._cancel_scheduled:
+            self._cancel_scheduled()
+
+        async def task(now):
+            self._cancel_scheduled = None
+            await self.async_refresh()
+
+        _LOGGER.debug('next token refresh in {:.0f}s'.format(delay))
+        self._cancel_scheduled = async_call_later(self._hass, delay, task)
@@ -0,0 +1,147 @@
+import asyncio
+import itertools
+import json
+import logging
+
+from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+# 发送优先级，数值越小越先发送
+PRIORITY_COMMAND = 0
+PRIORITY_HEARTBEAT = 1
+PRIORITY_REFRESH = 2
+
+# 发送队列长度，队列满时发送方需等待
+WS_SEND_QUEUE_SIZE = 100
+# 队列中积压的消息数超过该值时直接丢弃刷新请求，为控制命令留出空间
+WS_REFRESH_QUEUE_LIMIT = 20
+
+
+class WebSocketWriter:
+    """
+    每个连接仅由一个协程写入websocket，其他地方通过有界优先队列提交消息：
+    控制命令优先，其次是心跳，最后是刷新请求
+    """
+
+    def __init__(
+            self,
+            hass: HomeAssistant,
+            ws,
+            maxsize: int = WS_SEND_QUEUE_SIZE,
+            refresh_limit: int = WS_REFRESH_QUEUE_LIMIT
+    ):
+        self._hass = hass
+        self._ws = ws
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize)
+        self._refresh_limit = refresh_limit
+        self._seq = itertools.count()
+        # merge_key -> 队列中尚未发送的消息
+        self._merging = {}
+        # 正在写入的消息
+        self._current: dict | None = None
+        self._task: asyncio.Task | None = None
+        self._closed = False
+        self._sent = 0
+        self._merged = 0
+        self._dropped = 0
+
+    def start(self):
+        self._task = self._hass.async_create_background_task(self._run(), 'haier-ws-writer')
+
+    def close(self):
+        """
+        停止写入，队列中未发送的消息均以ConnectionError结束
+        :return:
+        """
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self._current is not None and not self._current['future'].done():
+            self._current['future'].set_exception(ConnectionError('device gateway disconnected'))
+        self._current = None
+        self._fail_pending()
+
+    def _fail_pending(self):
+        """
+        队列中未发送的消息均以ConnectionError结束
+        :return:
+        """
+        while not self._queue.empty():
+            _, _, item = self._queue.get_nowait()
+            if not item['future'].done():
+                item['future'].set_exception(ConnectionError('device gateway disconnected'))
+        self._merging = {}
+
+    async def send(self, payload: dict, priority: int = PRIORITY_COMMAND, merge_key: str = None) -> bool:
+        """
+        提交消息并等待写入完成
+        :param payload:
+        :param priority:
+        :param merge_key: 队列中已有相同merge_key的消息时只保留最新的内容
+        :return: 是否已写入，刷新请求在队列积压时会被丢弃并返回False
+        """
+        if self._closed:
+            raise ConnectionError('device gateway disconnected')
+
+        if merge_key is not None and merge_key in self._merging:
+            item = self._merging[merge_key]
+            item['payload'] = payload
+            self._merged += 1
+            await asyncio.shield(item['future'])
+            return True
+
+        if priority >= PRIORITY_REFRESH and self._queue.qsize() >= self._refresh_limit:
+            self._dropped += 1
+            _LOGGER.debug('Send queue is busy (%s), dropped refresh request', self._queue.qsize())
+            return False
+
+        future = self._hass.loop.create_future()
+        # 发送方被取消时避免出现 "exception was never retrieved" 日志
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        item = {'payload': payload, 'future': future, 'merge_key': merge_key}
+        if merge_key is not None:
+            self._merging[merge_key] = item
+
+        # 队列已满时在此等待，对发送方形成背压
+        await self._queue.put((priority, next(self._seq), item))
+
+        # 等待入队期间连接已关闭，队列不会再被读取
+        if self._closed:
+            self._fail_pending()
+            raise ConnectionError('device gateway disconnected')
+
+        await asyncio.shield(future)
+
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize(),
+            'sent': self._sent,
+            'merged': self._merged,
+            'dropped': self._dropped,
+        }
+
+    async def _run(self):
+        while True:
+            _, _, item = await self._queue.get()
+            if item['merge_key'] is not None:
+                self._merging.pop(item['merge_key'], None)
+
+            future = item['future']
+            self._current = item
+            try:
+                await self._ws.send_str(json.dumps(item['payload']))
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            finally:
+                self._current = None
+
+            self._sent += 1
+            if not future.done():
+                future.set_result(None)
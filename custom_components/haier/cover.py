@@ -1,4 +1,5 @@
 import logging
+from typing import List
 
 from homeassistant.components.cover import CoverEntity;
 from homeassistant.config_entries import ConfigEntry
@@ -26,30 +27,33 @@ class HaierCover(HaierAbstractEntity, CoverEntity):
     def __init__(self, device: HaierDevice, attribute: HaierAttribute):
         super().__init__(device, attribute)
 
+    def _get_data_keys(self) -> List[str]:
+        return ['onOffStatus', 'openDegree']
+
     def _update_value(self):
         self._attr_is_closed = try_read_as_bool(self._attributes_data['onOffStatus'])
         self._attr_current_cover_position = int(self._attributes_data['openDegree'])
 
-    def open_cover(self, **kwargs) -> None:
+    async def async_open_cover(self, **kwargs) -> None:
         _LOGGER.debug("执行窗帘打开")
-        self._send_command({
+        await self._async_send_command({
             'onOffStatus': True
         })
 
-    def close_cover(self, **kwargs) -> None:
+    async def async_close_cover(self, **kwargs) -> None:
         _LOGGER.debug("执行窗帘关闭")
-        self._send_command({
+        await self._async_send_command({
             'onOffStatus': False
         })
 
-    def stop_cover(self, **kwargs) -> None:
+    async def async_stop_cover(self, **kwargs) -> None:
         _LOGGER.debug("执行窗帘暂停")
-        self._send_command({
+        await self._async_send_command({
             'pause': True
         })
 
-    def set_cover_position(self,position: int) -> None:
+    async def async_set_cover_position(self,position: int) -> None:
         _LOGGER.debug("执行设置窗帘开合度")
-        self._send_command({
+        await self._async_send_command({
             'openDegree': position
         })
\ No newline at end of file
@@ -0,0 +1,28 @@
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    data = hass.data.get(DOMAIN, {})
+
+    client = data.get('client')
+    gateway = data.get('gateway')
+
+    return {
+        'devices': len(data.get('devices', [])),
+        'suppressed_writes': {
+            device.id: device.suppressed_writes for device in data.get('devices', []) if device.suppressed_writes
+        },
+        'circuit_breakers': [breaker.as_dict() for breaker in client.circuit_breakers] if client else [],
+        'gateway': {
+            'connections': gateway.connection_stats,
+            'commands': gateway.command_stats,
+            'refresh': gateway.refresh_stats,
+            'decode': gateway.decode_stats,
+            'suppressed_frames': gateway.suppressed_frames,
+        } if gateway else None,
+    }
@@ -1,17 +1,28 @@
+import asyncio
 import logging
+import time
 from abc import ABC, abstractmethod
+from typing import Any, List, Mapping
 
+from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.entity import DeviceInfo, Entity
+from homeassistant.helpers.event import async_call_later
 
 from . import DOMAIN
 from .core.attribute import HaierAttribute
 from .core.device import HaierDevice
-from .core.event import EVENT_DEVICE_DATA_CHANGED, EVENT_DEVICE_CONTROL, \
-    EVENT_DEVICE_ONLINE_CHANGED, EVENT_GATEWAY_DISCONNECTED
-from .core.event import listen_event, fire_event
+from .core.event import EVENT_DEVICE_DATA_CHANGED, EVENT_DEVICE_ONLINE_CHANGED, EVENT_GATEWAY_DISCONNECTED
+from .core.event import listen_device_event, fire_device_event
+from .helpers import normalize_value
 
 _LOGGER = logging.getLogger(__name__)
 
+# 等待设备确认写入值的时长（秒），超时后放弃未确认的写入值，乐观更新模式下恢复为设备上报的值
+OPTIMISTIC_CONFIRM_TIMEOUT = 10
+# 连续写入时最长等待多久（秒）必须下发一次，拖动滑块期间也能看到中间值
+WRITE_DEBOUNCE_MAX_WAIT = 2
+
 
 class HaierAbstractEntity(Entity, ABC):
 
@@ -39,50 +50,213 @@ class HaierAbstractEntity(Entity, ABC):
         self._attribute = attribute
         # 默认为不可用状态
         self._attr_available = False
-        # 保存当前设备下所有attribute的数据
-        self._attributes_data = {}
 
-    def _send_command(self, attributes):
+        # 防抖窗口内待下发的命令
+        self._debounce_attributes: dict | None = None
+        self._debounce_started_at = 0.0
+        self._debounce_cancel = None
+        # 等待本次防抖窗口下发结果的future
+        self._debounce_future: asyncio.Future | None = None
+
+    @property
+    def _attributes_data(self) -> Mapping[str, Any]:
+        """
+        当前设备下所有attribute的数据（只读，与同设备的其他实体共享）
+        :return:
+        """
+        if self._optimistic:
+            return self._device.state.optimistic_values
+
+        return self._device.state.values
+
+    @property
+    def _optimistic(self) -> bool:
+        advanced_cfg = self.hass.data[DOMAIN].get('advanced')
+
+        return advanced_cfg is not None and advanced_cfg.optimistic_update
+
+    async def _async_send_command(self, attributes: dict):
+        """
+        发送控制命令，开启等待确认时会等待网关确认
+        :param attributes:
+        :return:
+        """
+        try:
+            await self._async_write_command(attributes)
+        except asyncio.TimeoutError as e:
+            raise HomeAssistantError('设备 [{}] 未在规定时间内确认命令'.format(self._device.id)) from e
+        except ConnectionError as e:
+            raise HomeAssistantError('设备 [{}] 命令发送失败: {}'.format(self._device.id, e)) from e
+
+    async def _async_send_command_debounced(self, attributes: dict):
         """
-        发送控制命令
+        防抖发送控制命令，窗口内的多次写入只下发最后的值，所有调用方等待同一次下发的结果
         :param attributes:
         :return:
         """
-        fire_event(self.hass, EVENT_DEVICE_CONTROL, {
+        advanced_cfg = self.hass.data[DOMAIN].get('advanced')
+        window = advanced_cfg.write_debounce if advanced_cfg else 0
+        if window <= 0:
+            await self._async_send_command(attributes)
+            return
+
+        if self._debounce_attributes is None:
+            self._debounce_attributes = {}
+            self._debounce_started_at = time.monotonic()
+            self._debounce_future = self.hass.loop.create_future()
+            # 调用方被取消时避免出现 "exception was never retrieved" 日志
+            self._debounce_future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._debounce_attributes.update(attributes)
+        future = self._debounce_future
+
+        if self._debounce_cancel:
+            self._debounce_cancel()
+
+        # 窗口内没有新的写入时下发，持续写入时最多等待 WRITE_DEBOUNCE_MAX_WAIT
+        delay = min(window, max(0.0, self._debounce_started_at + WRITE_DEBOUNCE_MAX_WAIT - time.monotonic()))
+        self._debounce_cancel = async_call_later(self.hass, delay, self._flush_debounced_command)
+
+        await asyncio.shield(future)
+
+    @callback
+    def _flush_debounced_command(self, now=None):
+        self._debounce_cancel = None
+        attributes, self._debounce_attributes = self._debounce_attributes, None
+        future, self._debounce_future = self._debounce_future, None
+        if attributes:
+            self.hass.async_create_task(self._async_send_debounced_command(attributes, future))
+        elif future and not future.done():
+            future.set_result(None)
+
+    async def _async_send_debounced_command(self, attributes: dict, future: asyncio.Future):
+        try:
+            await self._async_send_command(attributes)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        if not future.done():
+            future.set_result(None)
+
+    async def _async_write_command(self, attributes: dict):
+        # 设备已处于目标状态时无需下发
+        if self._device.state.matches(attributes):
+            self._device.record_suppressed_write()
+            _LOGGER.debug('Device [{}] already in state {}, skip command'.format(self._device.id, attributes))
+            return
+
+        gateway = self.hass.data[DOMAIN]['gateway']
+        optimistic = self._optimistic
+
+        # 无论是否开启乐观更新都记录未确认的写入值，确认前再次写入同一key时不会被当作无需下发
+        pending = {
+            key: normalize_value(value) if isinstance(value, bool) else value
+            for key, value in attributes.items()
+        }
+        owner = self._device.state.set_pending(pending)
+        if optimistic:
+            # 先显示写入值，等待设备上报相同的值后确认
+            self._fire_data_changed(pending.keys())
+
+        try:
+            await gateway.async_send_command(self._device.id, attributes)
+        except Exception:
+            self._rollback(owner, optimistic)
+            raise
+
+        @callback
+        def confirm_timeout(now):
+            expired = self._rollback(owner, optimistic)
+            if expired and optimistic:
+                _LOGGER.warning('Device [{}] did not confirm {} in {}s, rolled back'.format(
+                    self._device.id, expired, OPTIMISTIC_CONFIRM_TIMEOUT
+                ))
+
+        async_call_later(self.hass, OPTIMISTIC_CONFIRM_TIMEOUT, confirm_timeout)
+
+    @callback
+    def _rollback(self, owner: object, optimistic: bool) -> List[str]:
+        """
+        放弃未确认的写入值，乐观更新模式下恢复显示设备上报的值
+        :param owner:
+        :param optimistic: 写入时是否为乐观更新模式
+        :return: 被放弃的key
+        """
+        expired = self._device.state.expire_pending(owner)
+        if expired and optimistic:
+            self._fire_data_changed(expired)
+
+        return expired
+
+    @callback
+    def _fire_data_changed(self, keys):
+        fire_device_event(self.hass, EVENT_DEVICE_DATA_CHANGED, self._device.id, {
             'deviceId': self._device.id,
-            'attributes': attributes
+            'changed': set(keys)
         })
 
     @abstractmethod
     def _update_value(self):
         pass
 
+    def _get_data_keys(self) -> List[str]:
+        """
+        实体所依赖的attribute key，只有这些key的值发生变化时实体才会刷新
+        :return:
+        """
+        return [self._attribute.ext.get('data_key', self._attribute.key)]
+
     async def async_added_to_hass(self) -> None:
-        # 监听网关状态
-        def gateway_disconnected_callback(event):
+        # 实体移除时丢弃未下发的防抖命令
+        @callback
+        def cancel_debounce():
+            if self._debounce_cancel:
+                self._debounce_cancel()
+                self._debounce_cancel = None
+            self._debounce_attributes = None
+            if self._debounce_future and not self._debounce_future.done():
+                self._debounce_future.set_exception(
+                    HomeAssistantError('设备 [{}] 实体已移除，命令未下发'.format(self._device.id))
+                )
+            self._debounce_future = None
+
+        self.async_on_remove(cancel_debounce)
+
+        # 监听网关状态（只会收到当前设备所在连接断线的事件）
+        @callback
+        def gateway_disconnected_callback(data):
             self._attr_available = False
-            self.schedule_update_ha_state()
+            self.async_write_ha_state()
 
-        self.async_on_remove(listen_event(self.hass, EVENT_GATEWAY_DISCONNECTED, gateway_disconnected_callback))
+        self.async_on_remove(
+            listen_device_event(self.hass, EVENT_GATEWAY_DISCONNECTED, self._device.id, gateway_disconnected_callback)
+        )
+
+        # 监听数据变化事件（只会收到当前设备的事件）
+        data_keys = set(self._get_data_keys())
 
-        # 监听数据变化事件
-        def data_callback(event):
-            if event.data['deviceId'] != self._device.id:
+        @callback
+        def data_callback(data):
+            # 实体可用且依赖的key没有变化时无需刷新
+            if self._attr_available and data_keys.isdisjoint(data['changed']):
                 return
 
             self._attr_available = True
-            self._attributes_data = event.data['attributes']
             self._update_value()
-            self.schedule_update_ha_state()
+            self.async_write_ha_state()
 
-        self.async_on_remove(listen_event(self.hass, EVENT_DEVICE_DATA_CHANGED, data_callback))
+        self.async_on_remove(
+            listen_device_event(self.hass, EVENT_DEVICE_DATA_CHANGED, self._device.id, data_callback)
+        )
 
         # 监听设备在线状态
-        def device_online_callback(event):
-            if event.data['deviceId'] != self._device.id:
-                return
+        @callback
+        def device_online_callback(data):
+            self._attr_available = data['online']
+            self.async_write_ha_state()
 
-            self._attr_available = event.data['online']
-            self.schedule_update_ha_state()
+        self.async_on_remove(
+            listen_device_event(self.hass, EVENT_DEVICE_ONLINE_CHANGED, self._device.id, device_online_callback)
+        )
 
-        self.async_on_remove(listen_event(self.hass, EVENT_DEVICE_ONLINE_CHANGED, device_online_callback))
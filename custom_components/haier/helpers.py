@@ -18,4 +18,26 @@ def contains_any_ignore_case(value, targets: list):
         if equals_ignore_case(value, target):
             return True
 
-    return False
\ No newline at end of file
+    return False
+
+def normalize_value(value) -> str:
+    """
+    将attribute值统一为字符串便于比较，如 True 与 'true'、40 与 '40' 与 40.0 视为相同
+    :param value:
+    :return:
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower()
+
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+    return str(int(number)) if number.is_integer() else str(number)
+
+def values_equal(value, target) -> bool:
+    return normalize_value(value) == normalize_value(target)
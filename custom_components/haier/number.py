@@ -31,8 +31,8 @@ class HaierNumber(HaierAbstractEntity, NumberEntity):
     def _update_value(self):
         self._attr_native_value = self._attributes_data[self._attribute.key]
 
-    def set_native_value(self, value: float) -> None:
-        self._send_command({
+    async def async_set_native_value(self, value: float) -> None:
+        await self._async_send_command_debounced({
             self._attribute.key: value
         })
 
@@ -35,9 +35,9 @@ class HaierSelect(HaierAbstractEntity, SelectEntity):
         data_key = self._attribute.ext.get('data_key', self._attribute.key)
         self._attr_current_option = self._get_value_from_comparison_table(self._attributes_data[data_key])
 
-    def select_option(self, option: str) -> None:
+    async def async_select_option(self, option: str) -> None:
         data_key = self._attribute.ext.get('data_key', self._attribute.key)
-        self._send_command({
+        await self._async_send_command({
             data_key: self._get_value_from_comparison_table(option)
         })
 
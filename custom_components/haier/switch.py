@@ -37,13 +37,13 @@ class HaierSwitch(HaierAbstractEntity, SwitchEntity):
             _LOGGER.exception('entity [{}] read value failed'.format(self._attr_unique_id))
             self._attr_available = False
 
-    def turn_on(self, **kwargs: Any) -> None:
-        self._send_command({
+    async def async_turn_on(self, **kwargs: Any) -> None:
+        await self._async_send_command({
             self._attribute.key: True
         })
 
-    def turn_off(self, **kwargs: Any) -> None:
-        self._send_command({
+    async def async_turn_off(self, **kwargs: Any) -> None:
+        await self._async_send_command({
             self._attribute.key: False
         })
 
@@ -1,5 +1,6 @@
 """Support for water heaters."""
 import logging
+from typing import List
 
 from homeassistant.components.water_heater import (
     WaterHeaterEntity,
@@ -45,11 +46,14 @@ class HaierWaterHeater(HaierAbstractEntity, WaterHeaterEntity):
         """List of available operation modes."""
         return [STATE_OFF, STATE_GAS]
 
-    def set_temperature(self, **kwargs) -> None:
-        self._send_command({
+    async def async_set_temperature(self, **kwargs) -> None:
+        await self._async_send_command({
             'targetTemp': kwargs['temperature']
         })
 
+    def _get_data_keys(self) -> List[str]:
+        return ['outWaterTemp', 'targetTemp', 'onOffStatus']
+
     def _update_value(self):
         if 'outWaterTemp' in self._attributes_data:
             self._attr_current_temperature = float(self._attributes_data['outWaterTemp'])
@@ -65,24 +69,24 @@ class HaierWaterHeater(HaierAbstractEntity, WaterHeaterEntity):
             self._attr_current_operation = STATE_GAS
             self._attr_is_away_mode_on = False
 
-    def turn_away_mode_on(self):
+    async def async_turn_away_mode_on(self):
         """Turn away mode on."""
-        self._send_command({
+        await self._async_send_command({
             'onOffStatus': False
         })
 
-    def turn_away_mode_off(self):
+    async def async_turn_away_mode_off(self):
         """Turn away mode off."""
-        self._send_command({
+        await self._async_send_command({
             'onOffStatus': True
         })
 
-    def set_operation_mode(self, operation_mode):
+    async def async_set_operation_mode(self, operation_mode):
         """Set operation mode"""
         if operation_mode == STATE_GAS:
             power_state = True
         else:
             power_state = False
-        self._send_command({
+        await self._async_send_command({
             'onOffStatus': power_state
         })